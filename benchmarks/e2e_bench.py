@@ -0,0 +1,99 @@
+"""
+End-to-end timings on synthetic metrics (see generate_metrics.py) at growing sizes:
+`metrics load`, every `metrics insight` kind (result cache off) and the export row
+builders of metrics_export.transforms on those results. Each scale gets its own
+metrics tree and warehouse under a temp dir (or --workdir, kept afterwards).
+
+    python benchmarks/e2e_bench.py [base-runs] [--scales 1 10 100] [--workers 1] [--repeat 3]
+"""
+import argparse
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from generate_metrics import generate
+from metrics_analytics import cache as result_cache
+from metrics_analytics.config import Config
+from metrics_analytics.ingest import ingest
+from metrics_analytics.queries import QueryEngine
+from metrics_export.transforms import (
+    _card_rows, _median_deck_rows, _pack_asc_rows, _pack_rows, _win_by_asc_rows, load_card_mappings
+)
+
+
+def best_of(fn, repeat: int) -> tuple[float, object]:
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def insight_cases(q: QueryEngine, card_to_pack: dict[str, str], card_to_rarity: dict[str, str], min_support: int):
+    """(insight kind as in `metrics insight`, query, row builder of its export)"""
+    return [
+        ("win_by_asc", lambda: q.win_rate_by_asc(), lambda t: _win_by_asc_rows(t, min_support)),
+        ("median_deck", lambda: q.median_deck_size_by_asc(), lambda t: _median_deck_rows(t, min_support)),
+        ("pack_pick", lambda: q.pack_pick_rate(), _pack_rows),
+        ("pack_win", lambda: q.pack_win_rate(min_support), _pack_rows),
+        ("card_pick", lambda: q.card_pick_rate(min_support), lambda t: _card_rows(t, card_to_pack, card_to_rarity)),
+        ("card_win", lambda: q.card_win_rate(min_support), lambda t: _card_rows(t, card_to_pack, card_to_rarity)),
+        ("win_by_asc_and_pack", lambda: q.pack_asc_win_rate(min_support), _pack_asc_rows),
+        ("expansion_enabled", lambda: q.expansion_rate(), lambda t: t.to_pylist()),
+    ]
+
+
+def run_scale(workdir: Path, runs: int, days: int, workers: int, repeat: int, min_support: int) -> None:
+    metrics_root, warehouse, mappings = workdir / "metrics", workdir / "warehouse", workdir / "mappings"
+
+    t0 = time.perf_counter()
+    files = generate(metrics_root, runs, days=days, mappings_dir=mappings)
+    gen_seconds = time.perf_counter() - t0
+    size = sum(p.stat().st_size for p in metrics_root.rglob("*") if p.is_file())
+    print(f"\n{runs} runs, {files} files, {size / 2**20:.1f} MiB (generated in {gen_seconds:.1f}s)")
+
+    t0 = time.perf_counter()
+    report = ingest(Config(metrics_root=metrics_root, warehouse_dir=warehouse), workers=workers)
+    load_seconds = time.perf_counter() - t0
+    print(f"  load          {load_seconds * 1000:10.1f} ms   {runs / load_seconds:10.0f} runs/s "
+          f"(parse {report.stage_seconds:.2f}s, rollups {report.rollup_seconds:.2f}s)")
+    for name, secs in report.slice_seconds.items():
+        print(f"    {name:<13}{secs * 1000:10.1f} ms")
+
+    _, card_to_pack, card_to_rarity = load_card_mappings(mappings)
+    with QueryEngine(warehouse / "metrics.duckdb") as q:
+        for kind, query, rows in insight_cases(q, card_to_pack, card_to_rarity, min_support):
+            query()  # warm the views and the Parquet metadata cache
+            q_seconds, table = best_of(query, repeat)
+            t_seconds, payload = best_of(lambda: rows(table), repeat)
+            print(f"  {kind:<20} query {q_seconds * 1000:8.2f} ms   transform {t_seconds * 1000:8.2f} ms   "
+                  f"{len(payload)} rows")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Time load, insights and export transforms on synthetic metrics.")
+    ap.add_argument("base_runs", type=int, nargs="?", default=2_000)
+    ap.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    ap.add_argument("--days", type=int, default=60)
+    ap.add_argument("--workers", type=int, default=1, help="passed to ingest, like metrics load --workers")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--min-support", type=int, default=1)
+    ap.add_argument("--workdir", type=Path, default=None, help="keep the generated data here instead of a temp dir")
+    args = ap.parse_args()
+
+    # time the queries, not cache reads
+    result_cache.set_enabled(False)
+    root = args.workdir or Path(tempfile.mkdtemp(prefix="metrics-bench-"))
+    try:
+        for scale in args.scales:
+            run_scale(root / f"x{scale}", args.base_runs * scale, args.days, args.workers, args.repeat,
+                      args.min_support)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Write synthetic run metrics in the layout `metrics load` reads: one ndjson file per day
+under <root>/<YYYY>/<MM>/<DD>, each line a run with the `event` fields tables.STAGE_SQL
+picks apart (packChoices, card_choices, master_deck, currentPacks, ...). Also writes the
+packCards.json / rarities.json mappings metrics-export needs, for the same cards.
+
+Pack and card popularity follow a Zipf-like law (`skew` 0 is uniform), and win rates
+depend on ascension and on the packs in the run, so every insight has some shape.
+
+    python benchmarks/generate_metrics.py <metrics-root> [runs] [--days 60] [--skew 1.1] [--mappings-dir data]
+"""
+import argparse
+import json
+import random
+from datetime import date, datetime, time, timedelta, timezone
+from pathlib import Path
+
+MOD_ID = "anniv5"
+RARITIES = ["COMMON", "UNCOMMON", "RARE"]
+CHARACTERS = ["IRONCLAD", "THE_SILENT", "DEFECT", "WATCHER", "THE_PACKMASTER"]
+PMVERSIONS = ["2.0.3", "2.1.0", "2.1.1"]
+HATS = ["Base", "Crown", "Beanie", "Tophat", None]
+KILLERS = ["Gremlin Nob", "Lagavulin", "The Champ", "Awakened One", "Time Eater", "Donu and Deca"]
+# cards a run sees per card reward, packs per pack choice, packs in a run
+CARDS_PER_CHOICE = 3
+PACKS_PER_CHOICE = 3
+PACKS_PER_RUN = 7
+
+
+class Universe:
+    """The mod's packs and cards, with skewed popularity and a hidden strength per pack."""
+
+    def __init__(self, packs: int, cards_per_pack: int, skew: float, rng: random.Random):
+        self.packs = [f"{MOD_ID}:Synth{i}Pack" for i in range(packs)]
+        self.pack_cards = {p: [f"{MOD_ID}:Synth{i}Card{j}" for j in range(cards_per_pack)]
+                           for i, p in enumerate(self.packs)}
+        self.cards = [c for cards in self.pack_cards.values() for c in cards]
+        self.rarity = {c: rng.choice(RARITIES) for c in self.cards}
+        self.strength = {p: rng.uniform(-0.08, 0.08) for p in self.packs}
+        self.pack_weights = [1 / (i + 1) ** skew for i in range(packs)]
+        self.card_weights = {p: [1 / (j + 1) ** skew for j in range(cards_per_pack)] for p in self.packs}
+
+    def mappings(self) -> tuple[dict[str, list[str]], dict[str, str]]:
+        return self.pack_cards, self.rarity
+
+
+def _sample(rng: random.Random, population: list, weights: list[float], k: int) -> list:
+    """k distinct items, drawn by weight."""
+    k = min(k, len(population))
+    out: list = []
+    while len(out) < k:
+        for item in rng.choices(population, weights, k=k - len(out)):
+            if item not in out:
+                out.append(item)
+    return out
+
+
+def _card_name(card: str, rng: random.Random) -> str:
+    return card + "+1" if rng.random() < 0.3 else card
+
+
+def make_run(u: Universe, ts: float, rng: random.Random) -> dict:
+    packs = _sample(rng, u.packs, u.pack_weights, PACKS_PER_RUN)
+    asc = rng.randint(0, 20)
+    victory = rng.random() < 0.55 - 0.02 * asc + sum(u.strength[p] for p in packs)
+    floor = 57 if victory else rng.randint(3, 56)
+
+    pack_choices = []
+    for _ in range(rng.randint(0, 3)):
+        offered = _sample(rng, u.packs, u.pack_weights, PACKS_PER_CHOICE)
+        pack_choices.append({"picked": offered[0], "not_picked": offered[1:]})
+
+    card_choices = []
+    for i in range(max(1, floor // 3)):
+        offered = []
+        for pack in _sample(rng, packs, [1.0] * len(packs), CARDS_PER_CHOICE):
+            offered.append(rng.choices(u.pack_cards[pack], u.card_weights[pack])[0])
+        offered = [_card_name(c, rng) for c in offered]
+        r = rng.random()
+        picked = "SKIP" if r < 0.15 else ("Singing Bowl" if r < 0.17 else offered.pop(rng.randrange(len(offered))))
+        card_choices.append({"picked": picked, "not_picked": offered, "floor": 3 * i + 1})
+
+    deck = [c["picked"] for c in card_choices if c["picked"] not in ("SKIP", "Singing Bowl")]
+    deck += [_card_name(rng.choices(u.pack_cards[p], u.card_weights[p])[0], rng) for p in packs]
+
+    return {
+        "time": int(ts),
+        "host": "synthetic",
+        "event": {
+            "play_id": f"{rng.getrandbits(64):016x}",
+            "victory": victory,
+            "ascension_level": asc,
+            "character_chosen": rng.choice(CHARACTERS),
+            "currentPacks": ",".join(packs),
+            "pmversion": rng.choices(PMVERSIONS, [1, 3, 6])[0],
+            "pickedHat": rng.choice(HATS),
+            "enabledExpansionPacks": rng.random() < 0.3,
+            "playtime": rng.randint(300, 5400),
+            "floor_reached": floor,
+            "killed_by": None if victory else rng.choice(KILLERS),
+            "packChoices": pack_choices,
+            "card_choices": card_choices,
+            "master_deck": deck,
+        },
+    }
+
+
+def generate(metrics_root: Path, runs: int, *, start: date = date(2025, 1, 1), days: int = 60,
+             packs: int = 60, cards_per_pack: int = 10, skew: float = 1.1, seed: int = 0,
+             mappings_dir: Path | None = None) -> int:
+    """Write `runs` runs spread evenly over `days` day files; returns the number of files written."""
+    rng = random.Random(seed)
+    u = Universe(packs, cards_per_pack, skew, rng)
+    days = max(1, min(days, runs))
+    for d in range(days):
+        day = start + timedelta(days=d)
+        n = runs // days + (d < runs % days)
+        midnight = datetime.combine(day, time(), timezone.utc).timestamp()
+        out = metrics_root / f"{day.year:04d}" / f"{day.month:02d}" / f"{day.day:02d}"
+        out.parent.mkdir(parents=True, exist_ok=True)
+        with open(out, "w", encoding="utf-8", newline="\n") as f:
+            for _ in range(n):
+                f.write(json.dumps(make_run(u, midnight + rng.uniform(0, 86399), rng), separators=(",", ":")))
+                f.write("\n")
+
+    if mappings_dir is not None:
+        pack_cards, rarity = u.mappings()
+        mappings_dir.mkdir(parents=True, exist_ok=True)
+        (mappings_dir / "packCards.json").write_text(json.dumps(pack_cards), encoding="utf-8")
+        (mappings_dir / "rarities.json").write_text(json.dumps(rarity), encoding="utf-8")
+    return days
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Write synthetic metrics run files.")
+    ap.add_argument("metrics_root", type=Path)
+    ap.add_argument("runs", type=int, nargs="?", default=10_000)
+    ap.add_argument("--start", type=date.fromisoformat, default=date(2025, 1, 1))
+    ap.add_argument("--days", type=int, default=60)
+    ap.add_argument("--packs", type=int, default=60)
+    ap.add_argument("--cards-per-pack", type=int, default=10)
+    ap.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of pack/card popularity; 0 is uniform")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--mappings-dir", type=Path, default=None, help="also write packCards.json and rarities.json here")
+    args = ap.parse_args()
+
+    files = generate(args.metrics_root, args.runs, start=args.start, days=args.days, packs=args.packs,
+                     cards_per_pack=args.cards_per_pack, skew=args.skew, seed=args.seed,
+                     mappings_dir=args.mappings_dir)
+    print(f"wrote {args.runs} runs in {files} day file(s) under {args.metrics_root}")
+
+
+if __name__ == "__main__":
+    main()
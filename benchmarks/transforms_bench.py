@@ -0,0 +1,118 @@
+"""
+Compare the columnar insight row builders in metrics_export.transforms (Arrow in)
+with the row-by-row loops they replaced (pandas in), on synthetic query results.
+The old path's DuckDB -> pandas conversion is not part of the timing.
+
+    python benchmarks/transforms_bench.py [cards] [repeat]
+"""
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from metrics_export.transforms import _card_rows, _format_pack, _pack_asc_rows, _pack_rows, _strip_modid_prefix
+
+RARITIES = ["COMMON", "UNCOMMON", "RARE", "SPECIAL"]
+
+
+# --- former implementations, kept as the reference ---
+def legacy_pack_rows(df: pd.DataFrame) -> list[list]:
+    rows = []
+    for pack, a, b, rate in df.itertuples(index=False, name=None):
+        rows.append([_format_pack(pack), int(a), int(b), f"{float(rate) * 100:.2f}"])
+    return rows
+
+
+def legacy_card_rows(df: pd.DataFrame, card_to_pack: dict[str, str], card_to_rarity: dict[str, str]) -> list[list]:
+    rows = []
+    for card, a, b, rate in df.itertuples(index=False, name=None):
+        rarity = card_to_rarity.get(card, "Unknown")
+        pack = card_to_pack.get(card)
+        if not pack:
+            continue
+        rows.append([rarity, _format_pack(pack), _strip_modid_prefix(card), int(a), int(b), f"{float(rate) * 100:.2f}"])
+    return rows
+
+
+def legacy_pack_asc_rows(df: pd.DataFrame) -> list[list]:
+    rows = []
+    for _, row in df.iterrows():
+        data_row = [
+            _format_pack(row["Pack"]),
+            f"{float(row['Overall Win Rate']) * 100:.2f}" if pd.notna(row.get("Overall Win Rate")) else "N/A",
+        ]
+        for lvl in range(20, -1, -1):
+            val = row.get(f"A{lvl}")
+            data_row.append(f"{float(val) * 100:.2f}" if pd.notna(val) else "N/A")
+        rows.append(data_row)
+    return rows
+
+
+# --- synthetic query results ---
+def make_inputs(n_cards: int, n_packs: int = 80, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    random.seed(seed)
+    packs = [f"anniv5:Pack{i}Pack" for i in range(n_packs)]
+    cards = [f"anniv5:Card{i}" for i in range(n_cards)]
+    # a few cards without a pack or a rarity, like cards removed from the mod
+    card_to_pack = {c: random.choice(packs) for c in cards if random.random() > 0.02}
+    card_to_rarity = {c: random.choice(RARITIES) for c in cards if random.random() > 0.02}
+
+    seen = rng.integers(1, 50_000, n_cards)
+    card_df = pd.DataFrame({
+        "Card": pd.Series(cards, dtype="str"),
+        "Picked": (seen * rng.random(n_cards)).astype("int64"),
+        "Seen": seen,
+    })
+    card_df["Pick Rate"] = card_df["Picked"] / card_df["Seen"]
+
+    total = rng.integers(1, 50_000, n_packs)
+    pack_df = pd.DataFrame({
+        "Pack": pd.Series(packs, dtype="str"),
+        "Wins": (total * rng.random(n_packs)).astype("int32"),
+        "Total": total,
+    })
+    pack_df["Win Rate"] = pack_df["Wins"] / pack_df["Total"]
+
+    asc = {"Pack": pd.Series(packs, dtype="str"), "Overall Win Rate": rng.random(n_packs)}
+    for lvl in range(20, -1, -1):
+        col = rng.random(n_packs)
+        col[rng.random(n_packs) < 0.1] = np.nan
+        asc[f"A{lvl}"] = col
+    return card_df, pack_df, pd.DataFrame(asc), card_to_pack, card_to_rarity
+
+
+def bench(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main(n_cards: int, repeat: int):
+    card_df, pack_df, asc_df, card_to_pack, card_to_rarity = make_inputs(n_cards)
+    card_tbl, pack_tbl, asc_tbl = (pa.Table.from_pandas(df, preserve_index=False) for df in (card_df, pack_df, asc_df))
+    cases = [
+        ("card rows", lambda: legacy_card_rows(card_df, card_to_pack, card_to_rarity),
+         lambda: _card_rows(card_tbl, card_to_pack, card_to_rarity)),
+        ("pack rows", lambda: legacy_pack_rows(pack_df), lambda: _pack_rows(pack_tbl)),
+        ("pack x asc rows", lambda: legacy_pack_asc_rows(asc_df), lambda: _pack_asc_rows(asc_tbl)),
+    ]
+
+    print(f"{n_cards} cards, best of {repeat}")
+    for name, old, new in cases:
+        if old() != new():
+            raise SystemExit(f"{name}: payloads differ")
+        t_old, t_new = bench(old, repeat), bench(new, repeat)
+        print(f"  {name:<16} loop {t_old * 1000:9.2f} ms   columnar {t_new * 1000:9.2f} ms   x{t_old / t_new:.1f}")
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    main(n, repeat)
@@ -0,0 +1,72 @@
+import gzip
+import re
+import tarfile
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+# Run files may be stored compressed: day files as <YYYY>/<MM>/<DD>.gz or .zst, or a whole
+# month as one tar archive <YYYY>/<MM>.tar (optionally .tar.gz/.tgz/.tar.zst) holding the
+# day files. Everything is decompressed as a stream while reading, never to disk. The
+# ledger tracks an archive as one file; its rows carry "<archive>!/<member>" as source_file.
+
+MEMBER_SEP = "!/"
+COMPRESSED_SUFFIXES = (".gz", ".zst")
+_MONTH_ARCHIVE = re.compile(r"^(\d{1,2})\.(tar|tar\.gz|tgz|tar\.zst)$")
+
+
+def is_compressed(name: str) -> bool:
+    return name.endswith(COMPRESSED_SUFFIXES)
+
+
+def month_archive(name: str) -> int | None:
+    """The month of a `<MM>.tar[.gz|.zst]` archive name, None for other names."""
+    m = _MONTH_ARCHIVE.match(name)
+    return int(m.group(1)) if m else None
+
+
+def archive_of_sql(col: str) -> str:
+    """SQL giving the ledger path a source_file came from: the archive for members, else the file itself."""
+    return f"split_part({col}, '{MEMBER_SEP}', 1)"
+
+
+def _zstd_reader(raw: BinaryIO) -> BinaryIO:
+    try:
+        from compression import zstd  # python >= 3.14
+        return zstd.ZstdFile(raw)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("reading .zst metrics needs the zstandard package: pip install metrics-analytics[zstd]")
+    return zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+
+
+def _decompress(name: str, raw: BinaryIO) -> BinaryIO:
+    if name.endswith(".gz") or name.endswith(".tgz"):
+        return gzip.GzipFile(fileobj=raw)
+    if name.endswith(".zst"):
+        return _zstd_reader(raw)
+    return raw
+
+
+def read_documents(path: str) -> Iterator[tuple[str, bytes]]:
+    """
+        (source_file, content) of the run files stored at `path`: the file
+        itself, decompressed if needed, or each day file of a month archive.
+        """
+    name = Path(path).name
+    with open(path, "rb") as raw:
+        if month_archive(name) is None:
+            with _decompress(name, raw) as f:
+                yield path, f.read()
+            return
+
+        # "r|" reads the archive front to back, without seeking, so it works on the decompressing stream
+        with _decompress(name, raw) as f, tarfile.open(fileobj=f, mode="r|") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                with _decompress(member.name, tar.extractfile(member)) as inner:
+                    yield f"{path}{MEMBER_SEP}{member.name}", inner.read()
+
@@ -0,0 +1,118 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import uuid
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pydantic import BaseModel
+
+from . import profile
+
+# bump when query output changes for the same arguments, so old entries stop matching
+CACHE_FORMAT = 2
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_enabled = True
+
+
+def set_enabled(enabled: bool) -> None:
+    global _enabled
+    _enabled = enabled
+
+
+def cache_dir(db: Path) -> Path:
+    return db.parent / "_cache"
+
+
+class ResultCache:
+    """Query results (Arrow tables) stored as Parquet files, evicted least recently used first past `max_bytes`."""
+
+    def __init__(self, root: Path, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}.parquet"
+
+    def get(self, key: str) -> pa.Table | None:
+        path = self._path(key)
+        try:
+            table = pq.read_table(path)
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        try:
+            os.utime(path)  # mtime doubles as last-used time for eviction
+        except FileNotFoundError:
+            pass  # evicted by another thread since the read; the table is still good
+        return table
+
+    def put(self, key: str, table: pa.Table) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f".{uuid.uuid4().hex}.tmp"
+        pq.write_table(table, tmp)
+        tmp.replace(self._path(key))
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        for p in self.root.glob("*.parquet"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            p.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self) -> None:
+        for p in self.root.glob("*.parquet"):
+            p.unlink(missing_ok=True)
+
+
+def _key(name: str, arguments: dict, version: str) -> str:
+    def encode(o):
+        return o.model_dump(mode="json") if isinstance(o, BaseModel) else str(o)
+
+    raw = json.dumps([CACHE_FORMAT, name, sorted(arguments.items()), version], default=encode)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def cached(fn):
+    """
+        Cache the Arrow table returned by a QueryEngine method.
+
+        Entries are keyed by the method, its arguments and the warehouse's
+        ledger version, so any ingest makes earlier results unreachable.
+        """
+    sig = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    def wrapper(engine, *args, **kwargs):
+        if not _enabled:
+            return fn(engine, *args, **kwargs)
+
+        # bind so that positional, keyword and default arguments give the same key
+        bound = sig.bind(engine, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        del arguments["self"]
+        key = _key(fn.__name__, arguments, engine.version())
+
+        cache = ResultCache(cache_dir(engine.db))
+        table = cache.get(key)
+        if (st := profile.current()) is not None:
+            st.attrs["cache"] = "miss" if table is None else "hit"
+        if table is None:
+            table = fn(engine, *args, **kwargs)
+            cache.put(key, table)
+        return table
+
+    return wrapper
@@ -1,17 +1,31 @@
 import typer
+from datetime import datetime
 from rich import print
 from pathlib import Path
 from rich.console import Console
 from rich.table import Table
+from . import cache as result_cache, profile
 from .config import Config
-from .ingest import ingest
+from .compact import compact as compact_warehouse
+from .ingest import ingest, rebuild_rollups
+from .warehouse import connect
 from .queries import (
-    win_rate_by_asc, pack_pick_rate, pack_win_rate, card_pick_rate, card_win_rate, pack_asc_win_rate, median_deck_size_by_asc, expansion_rate
+    Filters, win_rate_by_asc, pack_pick_rate, pack_win_rate, card_pick_rate, card_win_rate, pack_asc_win_rate, median_deck_size_by_asc, expansion_rate
 )
 
 app = typer.Typer(no_args_is_help=True)
 
 
+@app.callback()
+def main(
+        ctx: typer.Context,
+        profile_out: Path | None = typer.Option(None, "--profile", help="write per-stage timings and counters as JSON to this file ('-' for stdout)"),
+        explain: bool = typer.Option(False, help="with --profile, also capture EXPLAIN ANALYZE of every query (runs each query twice)"),
+):
+    if profile_out is not None:
+        ctx.call_on_close(profile.record_to(profile_out, ctx.invoked_subcommand or "", explain))
+
+
 def show_df(df):
     table = Table(show_header=True, header_style="bold cyan")
     for col in df.columns:
@@ -32,34 +46,105 @@ def init(warehouse: Path = typer.Option(Path("data/warehouse"))):
 @app.command()
 def load(
         metrics_root: Path = typer.Option(Path("data/metrics")),
-        warehouse: Path = typer.Option(Path("data/warehouse"))
+        warehouse: Path = typer.Option(Path("data/warehouse")),
+        workers: int = typer.Option(1, help="worker processes; months are ingested in parallel"),
+        skip_unchanged_dirs: bool = typer.Option(False, help="don't stat the files of older month dirs whose mtime is unchanged "
+                                                             "since the last load; misses files rewritten in place"),
+        full: bool = typer.Option(False, help="drop all ingested data and ingest every file again, "
+                                              "e.g. when the warehouse format changed")
 ):
     cfg = Config(metrics_root=metrics_root, warehouse_dir=warehouse)
-    n = ingest(cfg)
-    print(f"[cyan]Ingested {n} file(s)[/cyan]")
+    report = ingest(cfg, workers=workers, skip_unchanged_dirs=skip_unchanged_dirs, full=full)
+    print(f"[cyan]Ingested {report.files} file(s)[/cyan]")
+    print(f"  discovery: {report.discover_seconds:.2f}s"
+          + (f", {report.skipped_dirs} unchanged month dir(s) skipped" if skip_unchanged_dirs else ""))
+    if report.replaced_months:
+        print(f"  rewrote partitions of {report.replaced_months} month(s) with changed files")
+    if report.quarantined:
+        print(f"  [yellow]skipped {report.quarantined} malformed line(s), see `metrics quarantine`[/yellow]")
+    if report.files:
+        print(f"  parse: {report.stage_seconds:.2f}s")
+        for name, secs in report.slice_seconds.items():
+            print(f"  {name}: {secs:.2f}s")
+        print(f"  rollups: {report.rollup_seconds:.2f}s")
+
+
+@app.command()
+def quarantine(
+        warehouse: Path = typer.Option(Path("data/warehouse")),
+        source_file: str | None = typer.Option(None, help="only lines of this run file"),
+        limit: int = typer.Option(50),
+):
+    """
+    List malformed lines that ingest skipped. Fixing the run file in place
+    re-ingests it on the next load, which also clears its entries here.
+    """
+    con = connect(warehouse / "metrics.duckdb")
+    try:
+        df = con.execute("""
+        SELECT source_file, line_no, error, coalesce(left(TRY(decode(raw)), 80), '(not utf-8)') AS line, octet_length(raw) AS bytes, ingested_at
+        FROM quarantine
+        WHERE ? IS NULL OR source_file = ?
+        ORDER BY source_file, line_no
+        LIMIT ?
+        """, [source_file, source_file, limit]).df()
+        total = con.execute("SELECT count(*) FROM quarantine").fetchone()[0]
+    finally:
+        con.close()
+    show_df(df)
+    print(f"[cyan]{total} quarantined line(s) in total[/cyan]")
+
+
+@app.command()
+def rollup(warehouse: Path = typer.Option(Path("data/warehouse"))):
+    """Rebuild the rollup tables of every month from the slices."""
+    cfg = Config(warehouse_dir=warehouse)
+    n = rebuild_rollups(cfg)
+    print(f"[cyan]Rebuilt rollups for {n} month(s)[/cyan]")
+
+
+@app.command()
+def compact(
+        warehouse: Path = typer.Option(Path("data/warehouse")),
+        min_files: int = typer.Option(4, help="only rewrite partitions with at least this many files"),
+        row_group_size: int = typer.Option(1_000_000),
+        target_file_mb: int = typer.Option(256, help="approximate size of the rewritten files"),
+):
+    cfg = Config(warehouse_dir=warehouse)
+    report = compact_warehouse(cfg, min_files, row_group_size, target_file_mb * 1024 * 1024)
+    print(f"[cyan]Compacted {report.partitions} partition(s)[/cyan]")
+    if report.partitions:
+        print(f"  files: {report.files_before} -> {report.files_after}")
+        print(f"  bytes: {report.bytes_before:,} -> {report.bytes_after:,}")
 
 
 @app.command()
 def insight(kind: str,
             warehouse: Path = typer.Option(Path("data/warehouse")),
-            min_support: int = 100):
+            min_support: int = 100,
+            since: datetime | None = typer.Option(None, formats=["%Y-%m-%d"], help="first run date to include"),
+            until: datetime | None = typer.Option(None, formats=["%Y-%m-%d"], help="last run date to include"),
+            pmversion: str | None = typer.Option(None, help="only runs on this mod version"),
+            cache: bool = typer.Option(True, help="reuse results cached since the last ingest")):
     db = (warehouse / "metrics.duckdb")
+    result_cache.set_enabled(cache)
+    filters = Filters(since=since and since.date(), until=until and until.date(), pmversion=pmversion)
     if kind == "win_by_asc":
-        df = win_rate_by_asc(db)
+        df = win_rate_by_asc(db, filters=filters)
     elif kind == "median_deck":
-        df = median_deck_size_by_asc(db)
+        df = median_deck_size_by_asc(db, filters=filters)
     elif kind == "pack_pick":
-        df = pack_pick_rate(db)
+        df = pack_pick_rate(db, filters=filters)
     elif kind == "pack_win":
-        df = pack_win_rate(db, min_support)
+        df = pack_win_rate(db, min_support, filters=filters)
     elif kind == "card_pick":
-        df = card_pick_rate(db, min_support)
+        df = card_pick_rate(db, min_support, filters=filters)
     elif kind == "card_win":
-        df = card_win_rate(db, min_support)
+        df = card_win_rate(db, min_support, filters=filters)
     elif kind == "win_by_asc_and_pack":
-        df = pack_asc_win_rate(db, min_support)
+        df = pack_asc_win_rate(db, min_support, filters=filters)
     elif kind == "expansion_enabled":
-        df = expansion_rate(db)
+        df = expansion_rate(db, filters=filters)
     else:
         raise typer.BadParameter("Unknown kind")
     show_df(df)
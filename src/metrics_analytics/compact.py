@@ -0,0 +1,78 @@
+import shutil
+import uuid
+from pathlib import Path
+
+import duckdb
+from pydantic import BaseModel
+
+from .config import Config
+from .warehouse import connect, partition_files, partition_glob, publish_partition, sweep_partitions
+
+
+class CompactReport(BaseModel):
+    partitions: int = 0
+    files_before: int = 0
+    files_after: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+
+
+def _compact_partition(con: duckdb.DuckDBPyConnection, part: Path, staging_dir: Path,
+                       row_group_size: int, file_size_bytes: int):
+    """
+        Rewrite all Parquet files of one year=/month= partition into as few
+        files as `file_size_bytes` allows, published as its new version.
+        """
+    staging_dir.mkdir(parents=True, exist_ok=True)
+    scratch = staging_dir / uuid.uuid4().hex
+    try:
+        # partition columns live in the path, not in the files, same as PARTITION_BY writes them
+        con.execute(f"""
+        COPY (
+          SELECT * EXCLUDE (year, month)
+          FROM read_parquet('{partition_glob(part)}', hive_partitioning=true, union_by_name=true)
+        )
+        TO '{scratch.as_posix()}'
+        (FORMAT PARQUET,
+         COMPRESSION ZSTD,
+         ROW_GROUP_SIZE {int(row_group_size)},
+         FILE_SIZE_BYTES {int(file_size_bytes)})
+        """)
+        publish_partition(scratch, part)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def compact(config: Config, min_files: int = 4, row_group_size: int = 1_000_000,
+            file_size_bytes: int = 256 * 1024 * 1024) -> CompactReport:
+    """
+        Rewrite fragmented partitions (at least `min_files` Parquet files) of
+        every slice into a few large files.
+
+        Holding the warehouse db open keeps `metrics load` out while
+        partitions are rewritten. Each partition is replaced atomically by
+        publishing a new version (see warehouse.publish_partition); the old
+        versions are deleted by the next compact or load.
+        """
+    con = connect(config.duckdb_path)
+    report = CompactReport()
+    try:
+        sweep_partitions([*config.parquet_paths.values(), *config.rollup_paths.values()])
+        for dataset in config.parquet_paths.values():
+            for part in sorted(dataset.glob("year=*/month=*")):
+                files = partition_files(part)
+                if len(files) < min_files:
+                    continue
+
+                report.partitions += 1
+                report.files_before += len(files)
+                report.bytes_before += sum(f.stat().st_size for f in files)
+
+                _compact_partition(con, part, config.staging_dir, row_group_size, file_size_bytes)
+
+                files = partition_files(part)
+                report.files_after += len(files)
+                report.bytes_after += sum(f.stat().st_size for f in files)
+    finally:
+        con.close()
+    return report
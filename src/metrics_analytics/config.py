@@ -11,6 +11,11 @@ class Config(BaseModel):
     def duckdb_path(self) -> Path:
         return self.dbfile or (self.warehouse_dir / "metrics.duckdb")
 
+    @property
+    def staging_dir(self) -> Path:
+        # scratch space for partition rewrites; same filesystem as the datasets so swaps are renames
+        return self.warehouse_dir / "_staging"
+
     @property
     def parquet_paths(self) -> dict[str, Path]:
         w = self.warehouse_dir
@@ -21,3 +26,14 @@ class Config(BaseModel):
             "pack_choices": w / "pack_choices_parquet",
             "cards": w / "cards_parquet",
         }
+
+    @property
+    def rollup_paths(self) -> dict[str, Path]:
+        w = self.warehouse_dir
+        return {
+            "runs": w / "rollup_runs_parquet",
+            "packs": w / "rollup_packs_parquet",
+            "pack_choices": w / "rollup_pack_choices_parquet",
+            "card_choices": w / "rollup_card_choices_parquet",
+            "card_finals": w / "rollup_card_finals_parquet",
+        }
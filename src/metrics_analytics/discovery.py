@@ -0,0 +1,134 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import duckdb
+import pyarrow as pa
+from pydantic import BaseModel, Field
+
+from .archives import month_archive
+
+# stat() is I/O bound (and slow on network mounts), so use plenty of threads
+STAT_THREADS = 32
+
+
+class Discovery(BaseModel):
+    # (path, size, mtime) of every new or changed file
+    changed: list[tuple[str, int, int]] = Field(default_factory=list)
+    # month dir -> (year, month, mtime_ns) as seen before listing it; stored in the
+    # manifest once the month's files are ingested
+    dirs: dict[str, tuple[int, int, int]] = Field(default_factory=dict)
+    scanned_dirs: int = 0
+    skipped_dirs: int = 0
+
+
+def _subdirs(path: str) -> list[os.DirEntry]:
+    with os.scandir(path) as it:
+        return [e for e in it if e.is_dir()]
+
+
+def _month_dirs(metrics_root: Path) -> list[tuple[int, int, os.DirEntry]]:
+    # expects <root>/<YYYY>/<MM>/<DD>
+    out = []
+    if not metrics_root.is_dir():
+        return out
+    for ye in _subdirs(metrics_root):
+        if not ye.name.isdigit():
+            continue
+        for me in _subdirs(ye.path):
+            if me.name.isdigit():
+                out.append((int(ye.name), int(me.name), me))
+    return sorted(out, key=lambda t: (t[0], t[1]))
+
+
+def _month_archives(metrics_root: Path) -> list[os.DirEntry]:
+    # <root>/<YYYY>/<MM>.tar[.gz|.zst]; few enough (one per month) to always stat
+    out = []
+    if not metrics_root.is_dir():
+        return out
+    for ye in _subdirs(metrics_root):
+        if ye.name.isdigit():
+            with os.scandir(ye.path) as it:
+                out.extend(e for e in it if e.is_file() and month_archive(e.name) is not None)
+    return out
+
+
+def _day_files(month_dir: str) -> list[os.DirEntry]:
+    with os.scandir(month_dir) as it:
+        return [e for e in it if e.is_file()]
+
+
+def file_sig(p: Path | os.DirEntry):
+    st = p.stat() if isinstance(p, os.DirEntry) else os.stat(p)
+    return st.st_size, int(st.st_mtime)
+
+
+def discover_files(metrics_root: Path) -> list[Path]:
+    return sorted(Path(e.path) for _, _, me in _month_dirs(metrics_root) for e in _day_files(me.path))
+
+
+def stat_all(entries: list) -> list[tuple[str, int, int]]:
+    with ThreadPoolExecutor(max_workers=STAT_THREADS) as pool:
+        sigs = list(pool.map(file_sig, entries))
+    return [(str(e.path if isinstance(e, os.DirEntry) else e), size, mtime) for e, (size, mtime) in zip(entries, sigs)]
+
+
+def changed_vs_ledger(con: duckdb.DuckDBPyConnection, sigs: list[tuple[str, int, int]],
+                      ledger: str = "ingested_files") -> list[tuple[str, int, int]]:
+    """(path, size, mtime) of the files in `sigs` that `ledger` doesn't list with that size and mtime."""
+    # join against the ledger's primary key instead of pulling the whole ledger into python
+    paths, sizes, mtimes = zip(*sigs) if sigs else ((), (), ())
+    candidates = pa.table({
+        "path": pa.array(paths, pa.string()),
+        "size": pa.array(sizes, pa.int64()),
+        "mtime": pa.array(mtimes, pa.int64()),
+    })
+    con.register("candidates", candidates)
+    try:
+        return con.execute(f"""
+        SELECT c.path, c.size, c.mtime
+        FROM candidates c
+        LEFT JOIN {ledger} l ON l.path = c.path
+        WHERE l.path IS NULL OR l.size <> c.size OR l.mtime <> c.mtime
+        ORDER BY c.path
+        """).fetchall()
+    finally:
+        con.unregister("candidates")
+
+
+def discover(con: duckdb.DuckDBPyConnection, metrics_root: Path, paths: list[Path] | None = None,
+             skip_unchanged_dirs: bool = False) -> Discovery:
+    """
+        Find new and changed run files, plain or compressed, and month
+        archives (see archives.py), which are tracked as one file each.
+
+        Every file is stat-ed (in parallel) and compared with the ledger, so
+        files rewritten in place are found too. With `skip_unchanged_dirs`,
+        month directories whose mtime matches the `ingested_dirs` manifest
+        are skipped without listing or stat-ing their files. A directory's
+        mtime only moves when entries are added, removed or renamed, so that
+        misses files rewritten in place; the newest month (still being
+        appended to) is always scanned.
+        """
+    result = Discovery()
+    if paths:
+        result.changed = changed_vs_ledger(con, stat_all(list(paths)))
+        return result
+
+    manifest = dict(con.execute("SELECT path, mtime FROM ingested_dirs").fetchall()) if skip_unchanged_dirs else {}
+    months = _month_dirs(metrics_root)
+    newest = months[-1][:2] if months else None
+
+    entries: list[os.DirEntry] = []
+    for y, m, me in months:
+        mtime = me.stat().st_mtime_ns
+        if skip_unchanged_dirs and (y, m) != newest and manifest.get(me.path) == mtime:
+            result.skipped_dirs += 1
+            continue
+        result.dirs[me.path] = (y, m, mtime)
+        result.scanned_dirs += 1
+        entries.extend(_day_files(me.path))
+
+    entries.extend(_month_archives(metrics_root))
+    result.changed = changed_vs_ledger(con, stat_all(entries))
+    return result
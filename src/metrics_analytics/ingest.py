@@ -1,54 +1,146 @@
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import duckdb
+import numpy as np
 import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import shutil
+import time
+import uuid
 from pathlib import Path
 
+from pydantic import BaseModel, Field
+
+from . import profile
+from .archives import archive_of_sql, month_archive, read_documents
+from .cache import ResultCache, cache_dir
 from .config import Config
+from .discovery import discover
 from .tables import *
-from .warehouse import connect
+from .warehouse import (
+    append_to_partition, connect, current_version, partition_dir, partition_glob, publish_partition, stamp_format,
+    sweep_partitions
+)
 
 
 def parse_ym_from_path(p: Path) -> tuple[int, int]:
-    # expects .../<YYYY>/<MM>/<DD>
+    # expects .../<YYYY>/<MM>/<DD>[.gz|.zst] or a month archive .../<YYYY>/<MM>.tar[.gz|.zst]
     parts = p.parts
+    m = month_archive(p.name)
+    if m is not None:
+        return int(parts[-2]), m
     y, m = int(parts[-3]), int(parts[-2])
     return y, m
 
 
-def discover_files(metrics_root: Path) -> list[Path]:
-    return sorted(p for p in metrics_root.glob("*/*/*") if p.is_file())
+class IngestReport(BaseModel):
+    files: int = 0
+    discover_seconds: float = 0.0
+    # with skip_unchanged_dirs: month dirs the manifest showed unchanged, so their files weren't listed or stat-ed
+    skipped_dirs: int = 0
+    # months whose partitions were rewritten because they already held rows of the ingested files
+    replaced_months: int = 0
+    # malformed lines skipped and stored in the quarantine table
+    quarantined: int = 0
+    stage_seconds: float = 0.0
+    # slice name -> seconds spent writing it, summed over months
+    slice_seconds: dict[str, float] = Field(default_factory=dict)
+    rollup_seconds: float = 0.0
+
+    def add(self, other: "IngestReport") -> None:
+        self.replaced_months += other.replaced_months
+        self.quarantined += other.quarantined
+        self.stage_seconds += other.stage_seconds
+        self.rollup_seconds += other.rollup_seconds
+        for name, secs in other.slice_seconds.items():
+            self.slice_seconds[name] = self.slice_seconds.get(name, 0.0) + secs
+
 
+# raw bytes of run files split into lines per batch; bounds memory next to the staged month
+LINE_BATCH_BYTES = 256 * 1024 * 1024
 
-def file_sig(p: Path):
-    st = os.stat(p)
-    return st.st_size, int(st.st_mtime)
+QUARANTINE_SCHEMA = pa.schema([
+    ("source_file", pa.string()),
+    ("line_no", pa.int32()),
+    ("raw", pa.large_binary()),
+    ("error", pa.string()),
+])
 
 
-def _copy_month(con: duckdb.DuckDBPyConnection, sql_tail: str, out_dir: Path, month_glob: str, file_paths: list[str]):
+def _read_lines(file_paths: list[str]):
     """
-        Copy one month of JSON run files into a partitioned Parquet dataset.
-
-        Steps:
-        - Create a temp table listing the exact files to ingest (`file_paths`).
-        - Use read_json_auto on a month glob (e.g. ".../YYYY/MM/*") with filename=true.
-        - Join to the temp table to filter only the changed files.
-        - Apply BASE_CTE + sql_tail to shape the dataset.
-        - Write results into Parquet, partitioned by (year, month).
+        Yield the files as Arrow tables of (source_file, line_no, raw) lines,
+        batched up to LINE_BATCH_BYTES; at least one, possibly empty, table.
+        Lines are split by pyarrow, so there is no per-line Python work.
+        Compressed files and month archives are decompressed while reading,
+        each day file of an archive becoming its own source_file.
         """
-    out_dir.mkdir(parents=True, exist_ok=True)
+    names, counts, chunks, size = [], [], [], 0
+    batches = 0
+
+    def batch() -> pa.Table:
+        lines = pa.chunked_array(chunks, pa.large_binary()) if chunks else pa.chunked_array([], pa.large_binary())
+        line_no = np.concatenate([np.arange(1, n + 1, dtype=np.int32) for n in counts]) if counts else np.empty(0, np.int32)
+        file_idx = np.repeat(np.arange(len(names), dtype=np.int32), counts)
+        return pa.table({
+            "source_file": pc.take(pa.array(names, pa.string()), pa.array(file_idx)),
+            "line_no": pa.array(line_no),
+            "raw": lines,
+        })
+
+    for f in file_paths:
+        for source_file, data in read_documents(f):
+            lines = pc.split_pattern(pa.array([data], pa.large_binary()), b"\n").flatten()
+            names.append(source_file)
+            counts.append(len(lines))
+            chunks.append(lines)
+            size += len(data)
+            if size >= LINE_BATCH_BYTES:
+                yield batch()
+                batches += 1
+                names, counts, chunks, size = [], [], [], 0
+    # also when the files held no documents at all, e.g. a month archive without day files
+    if chunks or not batches:
+        yield batch()
+
+
+def _stage_month(con: duckdb.DuckDBPyConnection, year: int, month: int, file_paths: list[str]) -> pa.Table:
+    """
+        Parse the given JSON run files of one month into the `base` temp table
+        and return their malformed lines (see QUARANTINE_SCHEMA).
 
-    # Register files for this month
-    con.execute("CREATE TEMP TABLE to_ingest(path TEXT)")
-    con.executemany("INSERT INTO to_ingest VALUES (?)", [(p,) for p in file_paths])
+        Only the exact list of changed files is read, each once. Lines that
+        aren't valid UTF-8 JSON objects are set aside instead of failing the
+        month. Good lines are parsed once, with the declared schema of their
+        pmversion (schema.SCHEMAS), and the typed BASE columns are
+        materialized once, so the slices don't re-parse the JSON.
+        """
+    rejected = []
+    for i, lines in enumerate(_read_lines(file_paths)):
+        con.register("raw_lines", lines)
+        try:
+            con.execute(LINES_SQL)
+        finally:
+            con.unregister("raw_lines")
+        con.execute(STAGE_SQL if i == 0 else STAGE_APPEND_SQL, [year, month])
+        rejected.append(con.execute(QUARANTINE_SQL).to_arrow_table().cast(QUARANTINE_SCHEMA))
+    con.execute("DROP TABLE lines")
+    return pa.concat_tables(rejected)
+
+
+def _drop_stage(con: duckdb.DuckDBPyConnection):
+    con.execute("DROP TABLE IF EXISTS base")
 
-    # Parse year/month from the glob
-    year = int(month_glob.split("/")[-3])
-    month = int(month_glob.split("/")[-2])
 
+def _copy_slice(con: duckdb.DuckDBPyConnection, sql_tail: str, out_dir: Path, params: list | None = None):
+    """Write one slice of the staged month into Parquet under `out_dir`, partitioned by (year, month)."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # unique file names, so they can be moved next to a partition's existing files
     con.execute(f"""
     COPY (
-      {BASE_CTE}
       {sql_tail}
     )
     TO '{out_dir.as_posix()}'
@@ -57,50 +149,340 @@ def _copy_month(con: duckdb.DuckDBPyConnection, sql_tail: str, out_dir: Path, mo
      COMPRESSION ZSTD,
      ROW_GROUP_SIZE 1000000,
      PER_THREAD_OUTPUT FALSE,
-     APPEND)
-    """, [year, month, month_glob])
+     FILENAME_PATTERN 'data_{{uuid}}')
+    """, params)
 
-    con.execute("DROP TABLE to_ingest")
 
+def _replace_slice(con: duckdb.DuckDBPyConnection, sql_tail: str, out_dir: Path, staging_dir: Path,
+                   year: int, month: int, file_paths: list[str]):
+    """
+        Rewrite one (year, month) partition of a slice with the staged rows.
+
+        Rows left by earlier ingests of `file_paths` (of all their members, for
+        month archives) are dropped using their source_file lineage, rows of
+        the partition's other files are carried over. The result is published
+        as a new version of the partition.
+        """
+    files = partition_glob(partition_dir(out_dir, year, month))
+    params = None
+    if files:
+        sql_tail = f"""
+      SELECT * FROM read_parquet('{files}', hive_partitioning=true, union_by_name=true)
+      WHERE {archive_of_sql("source_file")} NOT IN (SELECT unnest(?::VARCHAR[]))
+      UNION ALL BY NAME
+      SELECT * FROM (
+        {sql_tail}
+      )"""
+        params = [file_paths]
+
+    _write_partition(con, sql_tail, out_dir, staging_dir, year, month, replace=True, params=params)
 
-def ingest(config: Config, paths: list[Path] | None = None) -> int:
+
+def _has_rows_of(con: duckdb.DuckDBPyConnection, part: Path, file_paths: list[str]) -> bool:
+    """Whether the partition already holds rows from any of `file_paths`, going by their source_file lineage."""
+    files = partition_glob(part)
+    if not files:
+        return False
+    return con.execute(f"""
+    SELECT 1
+    FROM read_parquet('{files}', hive_partitioning=true, union_by_name=true)
+    WHERE {archive_of_sql("source_file")} IN (SELECT unnest(?::VARCHAR[]))
+    LIMIT 1
+    """, [file_paths]).fetchone() is not None
+
+
+def _write_partition(con: duckdb.DuckDBPyConnection, sql_tail: str, out_dir: Path, staging_dir: Path,
+                     year: int, month: int, *, replace: bool, params: list | None = None):
+    """
+        Write the (year, month) rows of `sql_tail` under `staging_dir`, then
+        publish them as a new version of the partition (`replace`) or add them
+        to its current files.
+        """
+    scratch = staging_dir / uuid.uuid4().hex
+    try:
+        _copy_slice(con, sql_tail, scratch, params)
+        new, target = partition_dir(scratch, year, month), partition_dir(out_dir, year, month)
+        if replace:
+            publish_partition(new, target)
+        else:
+            append_to_partition(new, target)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def _build_rollups(con: duckdb.DuckDBPyConnection, config: Config, year: int, month: int):
+    """
+        Recompute the month's rollup partitions from its slice partitions.
+
+        Rollups are rebuilt from the whole month rather than merged with the
+        staged rows, so they stay correct when a re-ingest replaced rows.
+        """
+    present = set()
+    for name, dataset in config.parquet_paths.items():
+        files = partition_glob(partition_dir(dataset, year, month))
+        if files:
+            con.execute(f"""
+            CREATE OR REPLACE TEMP VIEW {name} AS
+            SELECT * FROM read_parquet('{files}', hive_partitioning=true, union_by_name=true)
+            """)
+            present.add(name)
+
+    for name, (inputs, sql) in ROLLUPS.items():
+        out_dir = config.rollup_paths[name]
+        if set(inputs) <= present:
+            _write_partition(con, sql, out_dir, config.staging_dir, year, month, replace=True)
+        elif partition_dir(out_dir, year, month).exists():
+            # nothing to aggregate for this month any more
+            publish_partition(None, partition_dir(out_dir, year, month))
+
+    for name in present:
+        con.execute(f"DROP VIEW {name}")
+
+
+def rebuild_rollups(config: Config) -> int:
+    """Rebuild the rollups of every month in the warehouse from its slices, e.g. after the rollup SQL changed."""
     con = connect(config.duckdb_path)
+    sweep_partitions([*config.parquet_paths.values(), *config.rollup_paths.values()])
+    months = set()
+    for dataset in config.parquet_paths.values():
+        for part in dataset.glob("year=*/month=*"):
+            months.add((int(part.parent.name.split("=")[1]), int(part.name.split("=")[1])))
+    try:
+        for y, m in sorted(months):
+            _build_rollups(con, config, y, m)
+    finally:
+        con.close()
+    ResultCache(cache_dir(config.duckdb_path)).clear()
+    return len(months)
+
+
+# dimension -> {key: name} seen while ingesting
+DimEntries = dict[str, dict[int, str]]
+
+
+def _encode_slice(con: duckdb.DuckDBPyConnection, name: str, dims: DimEntries) -> str:
+    """
+        Collect the dimension entries of the materialized `slice` table and
+        return the SELECT that writes it with names replaced by their keys.
+        """
+    encoded = []
+    for col, (key_col, dim) in SLICE_DIMENSIONS.get(name, {}).items():
+        rows = con.execute(f"SELECT DISTINCT {dim_key(col)}, {col} FROM slice WHERE {col} IS NOT NULL").fetchall()
+        dims.setdefault(dim, {}).update(rows)
+        encoded.append((col, f"{dim_key(col)} AS {key_col}"))
+
+    if not encoded:
+        return "SELECT * FROM slice"
+    return f"""
+      SELECT * EXCLUDE ({", ".join(col for col, _ in encoded)}),
+             {", ".join(expr for _, expr in encoded)}
+      FROM slice"""
+
+
+def _merge_dims(into: DimEntries, other: DimEntries):
+    for dim, entries in other.items():
+        into.setdefault(dim, {}).update(entries)
+
+
+def _store_dims(con: duckdb.DuckDBPyConnection, dims: DimEntries):
+    for dim, entries in dims.items():
+        if not entries:
+            continue
+        table, key_col, name_col = DIMENSIONS[dim]
+        new = pa.table({
+            key_col: pa.array(list(entries.keys()), pa.uint64()),
+            name_col: pa.array(list(entries.values()), pa.string()),
+        })
+        con.register("new_dim", new)
+        con.execute(f"INSERT OR IGNORE INTO {table} SELECT {key_col}, {name_col} FROM new_dim")
+        con.unregister("new_dim")
+
+
+def _store_quarantine(con: duckdb.DuckDBPyConnection, files: list[str], rejected: list[pa.Table]):
+    # a re-ingested file replaces the lines it had quarantined before
+    con.execute(f"DELETE FROM quarantine WHERE {archive_of_sql('source_file')} IN (SELECT unnest(?::VARCHAR[]))", [files])
+    rejected = [t for t in rejected if t.num_rows]
+    if not rejected:
+        return
+    con.register("new_quarantine", pa.concat_tables(rejected))
+    con.execute("INSERT INTO quarantine BY NAME SELECT * FROM new_quarantine")
+    con.unregister("new_quarantine")
+
+
+def _ingest_month(con: duckdb.DuckDBPyConnection, config: Config, year: int, month: int,
+                  files: list[str]) -> tuple[IngestReport, DimEntries, pa.Table]:
+    """
+        Stage one month's changed files and write every slice. Returns the
+        month's timings, the dimension entries and the quarantined lines to store.
+
+        A slice partition that already has rows of these files (re-ingested
+        files, or a retry of a month that failed after writing some slices)
+        is rewritten without them; otherwise the rows are appended.
+        """
+    report = IngestReport()
+    dims: DimEntries = {}
+
+    # parse the month once, then run one COPY per slice from the staged rows
+    t0 = time.perf_counter()
+    with profile.stage("ingest.parse", year=year, month=month, rows_in=len(files)) as st:
+        rejected = _stage_month(con, year, month, files)
+        report.quarantined = rejected.num_rows
+        if st is not None:
+            st.bytes_read = sum(os.path.getsize(f) for f in files)
+            st.rows_out = base_rows = _count(con, "base")
+    report.stage_seconds += time.perf_counter() - t0
+
+    for name, sql_tail in SLICES.items():
+        t0 = time.perf_counter()
+        with profile.stage(f"ingest.slice.{name}", year=year, month=month) as st:
+            part = partition_dir(config.parquet_paths[name], year, month)
+            replace = _has_rows_of(con, part, files)
+            report.replaced_months |= int(replace)
+            before = profile.dir_bytes(current_version(part)) if st is not None and not replace else 0
+            # materialize the slice once to both collect its names and write it encoded
+            con.execute(f"CREATE OR REPLACE TEMP TABLE slice AS {sql_tail}")
+            encoded = _encode_slice(con, name, dims)
+            if replace:
+                _replace_slice(con, encoded, config.parquet_paths[name], config.staging_dir, year, month, files)
+            else:
+                _write_partition(con, encoded, config.parquet_paths[name], config.staging_dir, year, month,
+                                 replace=False)
+            if st is not None:
+                st.rows_in, st.rows_out = base_rows, _count(con, "slice")
+                st.bytes_written = profile.dir_bytes(current_version(part)) - before
+        report.slice_seconds[name] = time.perf_counter() - t0
+
+    con.execute("DROP TABLE slice")
+    _drop_stage(con)
+
+    t0 = time.perf_counter()
+    with profile.stage("ingest.rollups", year=year, month=month):
+        _build_rollups(con, config, year, month)
+    report.rollup_seconds += time.perf_counter() - t0
+    return report, dims, rejected
+
+
+def _count(con: duckdb.DuckDBPyConnection, table: str) -> int:
+    return con.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+
+
+def _ingest_month_worker(config: Config, year: int, month: int, files: list[str], threads: int,
+                         profiling: bool) -> tuple[IngestReport, DimEntries, pa.Table, list[profile.Stage]]:
+    # Runs in a worker process. Only the coordinator may open the warehouse db, so
+    # workers use a private in-memory connection, write their partitions and hand
+    # the dimension entries, quarantined lines (and profile stages, if profiling) back.
+    con = duckdb.connect()
+    con.execute(f"PRAGMA threads = {threads}")
+    profiler = profile.enable() if profiling else None
+    try:
+        report, dims, rejected = _ingest_month(con, config, year, month, files)
+        return report, dims, rejected, profiler.profile.stages if profiler else []
+    finally:
+        profile.disable()
+        con.close()
+
+
+def _reset(con: duckdb.DuckDBPyConnection, config: Config):
+    """Drop every dataset and the ingest state, leaving an empty warehouse of the current format."""
+    for dataset in [*config.parquet_paths.values(), *config.rollup_paths.values()]:
+        shutil.rmtree(dataset, ignore_errors=True)
     con.begin()
+    for table in ["ingested_files", "ingested_dirs", "quarantine", *(t for t, _, _ in DIMENSIONS.values())]:
+        con.execute(f"DELETE FROM {table}")
+    stamp_format(con)
+    con.commit()
+    ResultCache(cache_dir(config.duckdb_path)).clear()
 
-    rows = con.execute("SELECT path, size, mtime FROM ingested_files").fetchall()
-    seen = {r[0]: (r[1], r[2]) for r in rows}
 
-    todo: list[tuple[Path, int, int]] = []
-    for f in (paths or discover_files(config.metrics_root)):
-        size, mtime = file_sig(f)
-        if seen.get(str(f)) != (size, mtime):
-            todo.append((f, size, mtime))
+def ingest(config: Config, paths: list[Path] | None = None, workers: int = 1,
+           skip_unchanged_dirs: bool = False, full: bool = False) -> IngestReport:
+    """
+        Ingest new and changed run files into the warehouse.
 
-    if not todo:
-        con.commit()
-        return 0
+        Months are independent, so with `workers > 1` they are spread across
+        worker processes. The ledger is updated by this process in one
+        transaction for all months that completed, also when another month failed.
+
+        `full` first empties the warehouse, so every file is ingested again;
+        that is also how a warehouse of an older format is upgraded.
+        """
+    con = connect(config.duckdb_path, check_format=not full)
+    if full:
+        _reset(con, config)
+    else:
+        # the db is held, so no reader can still use superseded partition versions
+        sweep_partitions([*config.parquet_paths.values(), *config.rollup_paths.values()])
+
+    t0 = time.perf_counter()
+    with profile.stage("ingest.discover", skip_unchanged_dirs=skip_unchanged_dirs) as st:
+        found = discover(con, config.metrics_root, paths, skip_unchanged_dirs)
+        if st is not None:
+            st.rows_out = len(found.changed)
+            st.attrs.update(scanned_dirs=found.scanned_dirs, skipped_dirs=found.skipped_dirs)
+    todo = found.changed
+    discover_seconds = time.perf_counter() - t0
 
     # group by (year, month)
     by_ym = defaultdict(list)
-    for f, size, mtime in todo:
-        y, m = parse_ym_from_path(f)
-        by_ym[(y, m)].append(str(f))
-
-    # build month globs like ".../YYYY/MM/*"
-    for (y, m), files in by_ym.items():
-        month_glob = config.metrics_root.joinpath(f"{y:04d}/{m:02d}/*").as_posix()
-
-        # run one COPY per slice for this month
-        _copy_month(con, SQL_RUNS,          config.parquet_paths["runs"],          month_glob, files)
-        _copy_month(con, SQL_MASTER_DECK,   config.parquet_paths["master_deck"],   month_glob, files)
-        _copy_month(con, SQL_PACKS_PRESENT, config.parquet_paths["packs_present"], month_glob, files)
-        _copy_month(con, SQL_PACK_CHOICES,  config.parquet_paths["pack_choices"],  month_glob, files)
-        _copy_month(con, SQL_CARDS,         config.parquet_paths["cards"],         month_glob, files)
-
-    # mark all ingested
-    con.executemany(
-        "INSERT OR REPLACE INTO ingested_files VALUES (?,?,?)",
-        [(str(f), size, mtime) for f, size, mtime in todo],
-    )
+    for f, _, _ in todo:
+        by_ym[parse_ym_from_path(Path(f))].append(f)
+
+    report = IngestReport(discover_seconds=discover_seconds, skipped_dirs=found.skipped_dirs)
+    dims: DimEntries = {}
+    quarantine: list[pa.Table] = []
+    done: set[tuple[int, int]] = set()
+    errors: list[BaseException] = []
+    if workers > 1:
+        threads = max(1, (os.cpu_count() or 4) // workers)
+        profiler = profile.active()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(_ingest_month_worker, config, y, m, files, threads,
+                            profiler is not None): (y, m)
+                for (y, m), files in by_ym.items()
+            }
+            for fut in as_completed(futures):
+                try:
+                    month_report, month_dims, rejected, stages = fut.result()
+                    if profiler:
+                        # peak_rss of these stages is the worker's
+                        profiler.add(stages)
+                    report.add(month_report)
+                    _merge_dims(dims, month_dims)
+                    quarantine.append(rejected)
+                    done.add(futures[fut])
+                except Exception as e:
+                    errors.append(e)
+                    for other in futures:
+                        other.cancel()
+    else:
+        for (y, m), files in by_ym.items():
+            try:
+                month_report, month_dims, rejected = _ingest_month(con, config, y, m, files)
+                report.add(month_report)
+                _merge_dims(dims, month_dims)
+                quarantine.append(rejected)
+                done.add((y, m))
+            except Exception as e:
+                errors.append(e)
+                break
+
+    # mark ingested whatever made it into the warehouse
+    files_done = [(f, size, mtime) for f, size, mtime in todo if parse_ym_from_path(Path(f)) in done]
+    dirs_done = [(d, mtime) for d, (y, m, mtime) in found.dirs.items() if (y, m) in done or (y, m) not in by_ym]
+    con.begin()
+    _store_dims(con, dims)
+    if files_done:
+        con.executemany("INSERT OR REPLACE INTO ingested_files VALUES (?,?,?)", files_done)
+        _store_quarantine(con, [f for f, _, _ in files_done], quarantine)
+    if dirs_done:
+        con.executemany("INSERT OR REPLACE INTO ingested_dirs VALUES (?,?)", dirs_done)
     con.commit()
-    return len(todo)
+    if files_done:
+        # the ledger version moved, so cached results can't be hit any more; free their space
+        ResultCache(cache_dir(config.duckdb_path)).clear()
+
+    if errors:
+        raise errors[0]
+    report.files = sum(len(by_ym[ym]) for ym in done)
+    return report
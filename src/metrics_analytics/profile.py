@@ -0,0 +1,149 @@
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from pydantic import BaseModel, Field
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+
+def peak_rss() -> int | None:
+    """High-water mark of this process's resident memory in bytes, None where it can't be read."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Stage(BaseModel):
+    """One timed step. Counters a step can't know are left None."""
+    name: str
+    seconds: float = 0.0
+    rows_in: int | None = None
+    rows_out: int | None = None
+    bytes_read: int | None = None
+    bytes_written: int | None = None
+    # process peak RSS when the step ended; grows only, so a jump points at the step that caused it
+    peak_rss: int | None = None
+    # EXPLAIN ANALYZE output of a query step, with --explain
+    explain: str | None = None
+    attrs: dict[str, Any] = Field(default_factory=dict)
+
+
+class Profile(BaseModel):
+    command: str = ""
+    seconds: float = 0.0
+    peak_rss: int | None = None
+    stages: list[Stage] = Field(default_factory=list)
+
+
+class Profiler:
+    """
+        Collects Stage records from any thread. Stages nest per thread, so a
+        step can annotate the stage it runs in through current().
+        """
+
+    def __init__(self, command: str = "", explain: bool = False):
+        self.explain = explain
+        self.profile = Profile(command=command)
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self) -> list[Stage]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def stage(self, name: str, **attrs: Any) -> Iterator[Stage]:
+        fields = {k: attrs.pop(k) for k in list(attrs) if k in Stage.model_fields}
+        record = Stage(name=name, attrs=attrs, **fields)
+        stack = self._stack()
+        stack.append(record)
+        t0 = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - t0
+            record.peak_rss = peak_rss()
+            stack.pop()
+            self.add([record])
+
+    def current(self) -> Stage | None:
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def add(self, stages: list[Stage]) -> None:
+        with self._lock:
+            self.profile.stages.extend(stages)
+
+    def finish(self) -> Profile:
+        self.profile.seconds = time.perf_counter() - self._t0
+        self.profile.peak_rss = peak_rss()
+        return self.profile
+
+
+_profiler: Profiler | None = None
+
+
+def enable(command: str = "", explain: bool = False) -> Profiler:
+    global _profiler
+    _profiler = Profiler(command, explain)
+    return _profiler
+
+
+def disable() -> None:
+    global _profiler
+    _profiler = None
+
+
+def active() -> Profiler | None:
+    return _profiler
+
+
+def current() -> Stage | None:
+    """The innermost open stage of this thread, if profiling."""
+    return _profiler.current() if _profiler is not None else None
+
+
+@contextmanager
+def stage(name: str, **attrs: Any) -> Iterator[Stage | None]:
+    """
+        Time the block as a stage of the active profiler. Yields its Stage to
+        fill in counters, or None when profiling is off (the default), in
+        which case nothing is measured.
+        """
+    if _profiler is None:
+        yield None
+        return
+    with _profiler.stage(name, **attrs) as record:
+        yield record
+
+
+def dir_bytes(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file()) if path.exists() else 0
+
+
+def write(profile: Profile, out: Path) -> None:
+    """Write the profile as JSON to `out`, or to stdout for '-'."""
+    text = json.dumps(profile.model_dump(mode="json"), indent=2)
+    if str(out) == "-":
+        print(text)
+    else:
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(text + "\n", encoding="utf-8")
+
+
+def record_to(out: Path, command: str = "", explain: bool = False) -> Callable[[], None]:
+    """Enable profiling for the rest of the process; returns the callback that writes the profile to `out`."""
+    profiler = enable(command, explain)
+    return lambda: write(profiler.finish(), out)
@@ -1,202 +1,383 @@
 import duckdb
+import functools
+import pandas as pd
+import pyarrow as pa
+import threading
+from datetime import date
 from pathlib import Path
 
+from pydantic import BaseModel
 
-def _con(db: Path) -> duckdb.DuckDBPyConnection:
-    return duckdb.connect(db.as_posix())
-
-
-def win_rate_by_asc(db: Path):
-    w = db.parent.as_posix()
-    sql = f"""
-    WITH r AS (
-      SELECT ascension_level, victory::INT AS win
-      FROM parquet_scan('{w}/runs_parquet')
-    )
-    SELECT
-      ascension_level        AS "Ascension Level",
-      CAST(SUM(win) AS INT)  AS "Won",
-      COUNT(*)               AS "Total",
-      AVG(win)               AS "Win Rate"
-    FROM r
-    GROUP BY ascension_level
-    ORDER BY ascension_level
-    """
-    return _con(db).execute(sql).df()
-
-
-def median_deck_size_by_asc(db: Path):
-    w = db.parent.as_posix()
-    sql = f"""
-    WITH r AS (
-      SELECT
-        ascension_level,
-        master_deck_size
-      FROM parquet_scan('{w}/runs_parquet')
-      WHERE victory
-    )
-    SELECT
-      ascension_level                   AS "Ascension Level",
-      median(master_deck_size)::INT     AS "Median Deck Size",
-      COUNT(*)                          AS "Winning Runs"
-    FROM r
-    GROUP BY ascension_level
-    ORDER BY ascension_level
-    """
-    return _con(db).execute(sql).df()
-
-
-def pack_pick_rate(db: Path):
-    w = db.parent.as_posix()
-    sql = f"""
-    WITH picked AS (
-      SELECT picked_pack AS pack, COUNT(*) AS picked_cnt
-      FROM parquet_scan('{w}/pack_choices_parquet')
-      WHERE picked_pack IS NOT NULL
-      GROUP BY 1
-    ),
-    offered AS (
-      SELECT COALESCE(picked_pack, not_picked_pack) AS pack, COUNT(*) AS offered_cnt
-      FROM parquet_scan('{w}/pack_choices_parquet')
-      GROUP BY 1
-    )
-    SELECT
-      o.pack                              AS "Pack",
-      COALESCE(p.picked_cnt, 0)           AS "Picked",
-      offered_cnt                         AS "Seen",
-      COALESCE(p.picked_cnt, 0)::DOUBLE / offered_cnt AS "Pick Rate"
-    FROM offered o
-    LEFT JOIN picked p USING (pack)
-    ORDER BY "Pick Rate" DESC
-    """
-    return _con(db).execute(sql).df()
-
-
-def pack_win_rate(db: Path, min_runs: int = 100):
-    w = db.parent.as_posix()
-    sql = f"""
-    WITH runs AS (
-      SELECT play_id, victory::INT AS win
-      FROM parquet_scan('{w}/runs_parquet')
-    ),
-    presence AS (
-      SELECT play_id, pack FROM parquet_scan('{w}/packs_present_parquet')
-    )
-    SELECT
-      p.pack                           AS "Pack",
-      CAST(SUM(r.win) AS INT)          AS "Wins",
-      COUNT(*)                         AS "Total",
-      AVG(r.win)                       AS "Win Rate"
-    FROM presence p
-    JOIN runs r USING (play_id)
-    GROUP BY p.pack
-    HAVING COUNT(*) >= {min_runs}
-    ORDER BY "Win Rate" DESC
-    """
-    return _con(db).execute(sql).df()
-
-
-def card_pick_rate(db: Path, min_seen: int = 200):
-    w = db.parent.as_posix()
-    sql = f"""
-    WITH choices AS (
-      SELECT card_id, picked::INT AS picked
-      FROM parquet_scan('{w}/cards_parquet')
-      WHERE context='choice'
-    )
-    SELECT
-      card_id                  AS "Card",
-      SUM(picked)              AS "Picked",
-      COUNT(*)                 AS "Seen",
-      AVG(picked)              AS "Pick Rate"
-    FROM choices
-    GROUP BY card_id
-    HAVING COUNT(*) >= {min_seen}
-    ORDER BY "Pick Rate" DESC
-    """
-    return _con(db).execute(sql).df()
-
-
-def card_win_rate(db: Path, min_decks: int = 200):
-    w = db.parent.as_posix()
-    sql = f"""
-    WITH finals AS (
-      SELECT play_id, card_id
-      FROM parquet_scan('{w}/cards_parquet')
-      WHERE context='final'
-    ),
-    runs AS (
-      SELECT play_id, victory::INT AS win
-      FROM parquet_scan('{w}/runs_parquet')
-    )
-    SELECT
-      f.card_id                            AS "Card",
-      CAST(SUM(r.win) AS INTEGER)          AS "Wins",
-      COUNT(*)                             AS "Total",
-      AVG(r.win)                           AS "Win Rate"
-    FROM finals f
-    JOIN runs r USING (play_id)
-    GROUP BY f.card_id
-    HAVING COUNT(*) >= {min_decks}
-    ORDER BY "Win Rate" DESC
-    """
-    return _con(db).execute(sql).df()
-
-
-def pack_asc_win_rate(db: Path, min_runs: int = 1):
-    w = db.parent.as_posix()
-    asc_cols = "\n      ".join(
-        f"MAX(CASE WHEN pa.ascension_level = {lvl} THEN pa.win_rate END) AS \"A{lvl}\","
-        for lvl in range(20, -1, -1)
-    )
-
-    sql = f"""
-    WITH runs AS (
-      SELECT play_id, ascension_level::INT AS ascension_level, victory::INT AS win
-      FROM parquet_scan('{w}/runs_parquet')
-    ),
-    presence AS (
-      SELECT play_id, TRIM(pack) AS pack
-      FROM parquet_scan('{w}/packs_present_parquet')
-    ),
-    pack_overall AS (
-      SELECT p.pack, SUM(r.win) AS wins, COUNT(*) AS total
-      FROM presence p
-      JOIN runs r USING (play_id)
-      GROUP BY p.pack
-      HAVING COUNT(*) >= {min_runs}
-    ),
-    pack_asc AS (
-      SELECT p.pack, r.ascension_level, AVG(r.win) AS win_rate
-      FROM presence p
-      JOIN runs r USING (play_id)
-      GROUP BY p.pack, r.ascension_level
-    )
-    SELECT
-      po.pack                                         AS "Pack",
-      (po.wins::DOUBLE / NULLIF(po.total,0))          AS "Overall Win Rate",
-      {asc_cols}
-    FROM pack_overall po
-    LEFT JOIN pack_asc pa ON pa.pack = po.pack
-    GROUP BY po.pack, po.wins, po.total
-    ORDER BY "Overall Win Rate" DESC, "Pack"
+from . import profile
+from .cache import cached
+from .config import Config
+from .tables import dim_key
+from .warehouse import connect, dataset_globs, ledger_version
+
+# The insights read the per-month rollup datasets maintained by ingest (see tables.ROLLUPS),
+# not the raw slices, so their cost doesn't grow with the number of runs. Rollups are keyed
+# by card/pack keys; names are joined in from the dim_* tables after aggregating. Results are
+# cached on disk per warehouse version, see cache.cached. With --profile each insight is also recorded
+# as a query.<name> stage, see profile.py.
+
+
+class Filters(BaseModel):
+    # inclusive run dates
+    since: date | None = None
+    until: date | None = None
+    pmversion: str | None = None
+
+
+def _add_month(d: date, months: int) -> tuple[int, int]:
+    n = d.year * 12 + d.month - 1 + months
+    return n // 12, n % 12 + 1
+
+
+def _where(filters: Filters | None) -> tuple[str, list]:
     """
-    return _con(db).execute(sql).df()
-
-
-def expansion_rate(db: Path):
-    w = db.parent.as_posix()
-    sql = f"""
-    WITH agg AS (
-      SELECT
-        COUNT(*) AS total_runs,
-        SUM(CASE WHEN expansion_enabled THEN 1 ELSE 0 END) AS with_expansion
-      FROM parquet_scan('{w}/runs_parquet')
-    )
-    SELECT
-      total_runs                                  AS "Total Runs",
-      with_expansion::INT                         AS "With Expansion",
-      CAST(with_expansion AS DOUBLE) / total_runs AS "Rate"
-    FROM agg
+        Predicate over a rollup scan and its parameters. The date bounds are
+        also applied to the year/month partition columns so that DuckDB skips
+        the partitions outside the range without opening them (a row
+        comparison of the plain columns is pushed down through the views,
+        expressions over them are not). The partition is the month of the run
+        file's path, which can differ from the month of the run's UTC `day`
+        near a month boundary, so the partition bounds are one month wider.
+        """
+    clauses, params = ["TRUE"], []
+    if filters and filters.since:
+        clauses.append("(year, month) >= (?, ?)")
+        clauses.append("day >= ?::DATE")
+        params += [*_add_month(filters.since, -1), filters.since]
+    if filters and filters.until:
+        clauses.append("(year, month) <= (?, ?)")
+        clauses.append("day <= ?::DATE")
+        params += [*_add_month(filters.until, 1), filters.until]
+    if filters and filters.pmversion:
+        clauses.append(f"pmversion_key = {dim_key('?::VARCHAR')}")
+        params.append(filters.pmversion)
+    return " AND ".join(clauses), params
+
+
+def _profiled(fn):
+    """Record an insight query as a `query.<name>` profile stage, see profile.stage."""
+
+    @functools.wraps(fn)
+    def wrapper(engine, *args, **kwargs):
+        with profile.stage(f"query.{fn.__name__}") as st:
+            table = fn(engine, *args, **kwargs)
+            if st is not None:
+                st.rows_out = table.num_rows
+                st.attrs["result_bytes"] = table.nbytes
+            return table
+
+    return wrapper
+
+
+class QueryEngine:
     """
-    return _con(db).execute(sql).df()
+        Session over one warehouse db: a single warm connection with the
+        rollup datasets registered as `rollup_<name>` views, so every insight
+        is a fixed, parameterized statement and the connection, catalog and
+        Parquet metadata cache are reused across insights.
+
+        Insights come back as Arrow tables, straight from DuckDB's Arrow
+        export; the module-level functions convert them to pandas unless
+        asked for Arrow. The engine can be shared between threads; each thread
+        queries through its own cursor on the shared connection.
+        """
+
+    def __init__(self, db: Path):
+        self.db = db
+        self.con = connect(db)
+        self._local = threading.local()
+
+    def close(self) -> None:
+        self.con.close()
+
+    def __enter__(self) -> "QueryEngine":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _cursor(self) -> duckdb.DuckDBPyConnection:
+        local = self._local
+        if not hasattr(local, "cursor"):
+            local.cursor = self.con.cursor()
+            local.views, local.version = {}, None
+        # temp views are per cursor. They list the current version of every partition (see
+        # warehouse.publish_partition), so they are re-resolved whenever an ingest moved the
+        # ledger; compaction keeps the rows and can't run while another process holds the db.
+        # Datasets appear with the first ingest, so keep trying the missing ones.
+        rollups = Config(warehouse_dir=self.db.parent).rollup_paths
+        version = ledger_version(local.cursor)
+        if version == local.version and len(local.views) == len(rollups):
+            return local.cursor
+        for name, dataset in rollups.items():
+            files = dataset_globs(dataset)
+            if not files or local.views.get(name) == files:
+                continue
+            local.cursor.execute(f"""
+            CREATE OR REPLACE TEMP VIEW rollup_{name} AS
+            SELECT * FROM parquet_scan([{", ".join(f"'{f}'" for f in files)}], hive_partitioning=true, union_by_name=true)
+            """)
+            local.views[name] = files
+        local.version = version
+        return local.cursor
+
+    def execute(self, sql: str, params: list | None = None) -> pa.Table:
+        cursor = self._cursor()
+        profiler = profile.active()
+        if profiler and profiler.explain and (st := profiler.current()) is not None:
+            # runs the statement a second time; only with --explain
+            plan = cursor.execute("EXPLAIN ANALYZE " + sql, params).fetchall()
+            st.explain = "\n".join(row[-1] for row in plan)
+        return cursor.execute(sql, params).to_arrow_table()
+
+    def to_df(self, table: pa.Table) -> pd.DataFrame:
+        # through duckdb rather than Table.to_pandas() so dtypes match .df() (e.g. nullable ints)
+        return self._cursor().from_arrow(table).df()
+
+    def version(self) -> str:
+        return ledger_version(self._cursor())
+
+    @_profiled
+    @cached
+    def win_rate_by_asc(self, filters: Filters | None = None) -> pa.Table:
+        where, params = _where(filters)
+        sql = f"""
+        SELECT
+          ascension_level                          AS "Ascension Level",
+          CAST(SUM(runs * victory::INT) AS INT)    AS "Won",
+          SUM(runs)::BIGINT                        AS "Total",
+          SUM(runs * victory::INT) / SUM(runs)     AS "Win Rate"
+        FROM rollup_runs
+        WHERE {where}
+        GROUP BY ascension_level
+        ORDER BY ascension_level
+        """
+        return self.execute(sql, params)
+
+    @_profiled
+    @cached
+    def median_deck_size_by_asc(self, filters: Filters | None = None) -> pa.Table:
+        where, params = _where(filters)
+        # exact median from the deck size histogram: average of the values at the two middle positions
+        sql = f"""
+        WITH hist AS (
+          SELECT ascension_level, master_deck_size AS size, SUM(runs) AS n
+          FROM rollup_runs
+          WHERE victory AND {where}
+          GROUP BY ALL
+        ),
+        cum AS (
+          SELECT *,
+            SUM(n) OVER (PARTITION BY ascension_level ORDER BY size) AS upto,
+            SUM(n) OVER (PARTITION BY ascension_level)              AS total
+          FROM hist
+        )
+        SELECT
+          ascension_level                                                   AS "Ascension Level",
+          ((MIN(size) FILTER (WHERE upto > (total - 1) // 2)
+            + MIN(size) FILTER (WHERE upto > total // 2)) / 2)::INT        AS "Median Deck Size",
+          ANY_VALUE(total)::BIGINT                                          AS "Winning Runs"
+        FROM cum
+        GROUP BY ascension_level
+        ORDER BY ascension_level
+        """
+        return self.execute(sql, params)
+
+    @_profiled
+    @cached
+    def pack_pick_rate(self, filters: Filters | None = None) -> pa.Table:
+        where, params = _where(filters)
+        sql = f"""
+        WITH agg AS (
+          SELECT pack_key, SUM(picked) AS picked, SUM(offered) AS offered
+          FROM rollup_pack_choices
+          WHERE {where}
+          GROUP BY pack_key
+        )
+        SELECT
+          d.pack                                AS "Pack",
+          picked::BIGINT                        AS "Picked",
+          offered::BIGINT                       AS "Seen",
+          picked::DOUBLE / offered              AS "Pick Rate"
+        FROM agg
+        LEFT JOIN dim_pack d USING (pack_key)
+        ORDER BY "Pick Rate" DESC
+        """
+        return self.execute(sql, params)
+
+    @_profiled
+    @cached
+    def pack_win_rate(self, min_runs: int = 100, filters: Filters | None = None) -> pa.Table:
+        where, params = _where(filters)
+        sql = f"""
+        WITH agg AS (
+          SELECT pack_key, SUM(wins) AS wins, SUM(total) AS total
+          FROM rollup_packs
+          WHERE {where}
+          GROUP BY pack_key
+          HAVING SUM(total) >= ?
+        )
+        SELECT
+          d.pack                               AS "Pack",
+          CAST(wins AS INT)                    AS "Wins",
+          total::BIGINT                        AS "Total",
+          wins::DOUBLE / total                 AS "Win Rate"
+        FROM agg
+        LEFT JOIN dim_pack d USING (pack_key)
+        ORDER BY "Win Rate" DESC
+        """
+        return self.execute(sql, params + [min_runs])
+
+    @_profiled
+    @cached
+    def card_pick_rate(self, min_seen: int = 200, filters: Filters | None = None) -> pa.Table:
+        where, params = _where(filters)
+        sql = f"""
+        WITH agg AS (
+          SELECT card_key, SUM(picked) AS picked, SUM(seen) AS seen
+          FROM rollup_card_choices
+          WHERE {where}
+          GROUP BY card_key
+          HAVING SUM(seen) >= ?
+        )
+        SELECT
+          d.card_id                            AS "Card",
+          picked::BIGINT                       AS "Picked",
+          seen::BIGINT                         AS "Seen",
+          picked::DOUBLE / seen                AS "Pick Rate"
+        FROM agg
+        LEFT JOIN dim_card d USING (card_key)
+        ORDER BY "Pick Rate" DESC
+        """
+        return self.execute(sql, params + [min_seen])
+
+    @_profiled
+    @cached
+    def card_win_rate(self, min_decks: int = 200, filters: Filters | None = None) -> pa.Table:
+        where, params = _where(filters)
+        sql = f"""
+        WITH agg AS (
+          SELECT card_key, SUM(wins) AS wins, SUM(total) AS total
+          FROM rollup_card_finals
+          WHERE {where}
+          GROUP BY card_key
+          HAVING SUM(total) >= ?
+        )
+        SELECT
+          d.card_id                            AS "Card",
+          CAST(wins AS INTEGER)                AS "Wins",
+          total::BIGINT                        AS "Total",
+          wins::DOUBLE / total                 AS "Win Rate"
+        FROM agg
+        LEFT JOIN dim_card d USING (card_key)
+        ORDER BY "Win Rate" DESC
+        """
+        return self.execute(sql, params + [min_decks])
+
+    @_profiled
+    @cached
+    def pack_asc_win_rate(self, min_runs: int = 1, filters: Filters | None = None) -> pa.Table:
+        where, params = _where(filters)
+        asc_cols = "\n          ".join(
+            f"MAX(CASE WHEN pa.ascension_level = {lvl} THEN pa.win_rate END) AS \"A{lvl}\","
+            for lvl in range(20, -1, -1)
+        )
+
+        sql = f"""
+        WITH pack_overall AS (
+          SELECT pack_key, SUM(wins) AS wins, SUM(total) AS total
+          FROM rollup_packs
+          WHERE {where}
+          GROUP BY pack_key
+          HAVING SUM(total) >= ?
+        ),
+        pack_asc AS (
+          SELECT pack_key, ascension_level, SUM(wins)::DOUBLE / SUM(total) AS win_rate
+          FROM rollup_packs
+          WHERE {where}
+          GROUP BY pack_key, ascension_level
+        )
+        SELECT
+          d.pack                                          AS "Pack",
+          (po.wins::DOUBLE / NULLIF(po.total,0))          AS "Overall Win Rate",
+          {asc_cols}
+        FROM pack_overall po
+        LEFT JOIN pack_asc pa ON pa.pack_key = po.pack_key
+        LEFT JOIN dim_pack d ON d.pack_key = po.pack_key
+        GROUP BY po.pack_key, d.pack, po.wins, po.total
+        ORDER BY "Overall Win Rate" DESC, "Pack"
+        """
+        return self.execute(sql, params + [min_runs] + params)
+
+    @_profiled
+    @cached
+    def expansion_rate(self, filters: Filters | None = None) -> pa.Table:
+        where, params = _where(filters)
+        sql = f"""
+        WITH agg AS (
+          SELECT
+            COALESCE(SUM(runs), 0)::BIGINT              AS total_runs,
+            SUM(runs * expansion_enabled::INT)          AS with_expansion
+          FROM rollup_runs
+          WHERE {where}
+        )
+        SELECT
+          total_runs                                  AS "Total Runs",
+          with_expansion::INT                         AS "With Expansion",
+          CAST(with_expansion AS DOUBLE) / total_runs AS "Rate"
+        FROM agg
+        """
+        return self.execute(sql, params)
+
+
+_engines: dict[Path, QueryEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def engine(db: Path) -> QueryEngine:
+    """The process-wide engine for `db`, opened on first use."""
+    key = db.resolve()
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = QueryEngine(db)
+        return _engines[key]
+
+
+def _result(db: Path, table: pa.Table, as_arrow: bool):
+    return table if as_arrow else engine(db).to_df(table)
+
+
+def win_rate_by_asc(db: Path, filters: Filters | None = None, as_arrow: bool = False):
+    return _result(db, engine(db).win_rate_by_asc(filters), as_arrow)
+
+
+def median_deck_size_by_asc(db: Path, filters: Filters | None = None, as_arrow: bool = False):
+    return _result(db, engine(db).median_deck_size_by_asc(filters), as_arrow)
+
+
+def pack_pick_rate(db: Path, filters: Filters | None = None, as_arrow: bool = False):
+    return _result(db, engine(db).pack_pick_rate(filters), as_arrow)
+
+
+def pack_win_rate(db: Path, min_runs: int = 100, filters: Filters | None = None, as_arrow: bool = False):
+    return _result(db, engine(db).pack_win_rate(min_runs, filters), as_arrow)
+
+
+def card_pick_rate(db: Path, min_seen: int = 200, filters: Filters | None = None, as_arrow: bool = False):
+    return _result(db, engine(db).card_pick_rate(min_seen, filters), as_arrow)
+
+
+def card_win_rate(db: Path, min_decks: int = 200, filters: Filters | None = None, as_arrow: bool = False):
+    return _result(db, engine(db).card_win_rate(min_decks, filters), as_arrow)
+
+
+def pack_asc_win_rate(db: Path, min_runs: int = 1, filters: Filters | None = None, as_arrow: bool = False):
+    return _result(db, engine(db).pack_asc_win_rate(min_runs, filters), as_arrow)
+
+
+def expansion_rate(db: Path, filters: Filters | None = None, as_arrow: bool = False):
+    return _result(db, engine(db).expansion_rate(filters), as_arrow)
@@ -0,0 +1,130 @@
+import json
+
+from pydantic import BaseModel
+
+# Declared shape of the run records, per mod version. Ingest parses every line with
+# json_transform against the schema of its pmversion instead of inferring types from the
+# data: each line is parsed once, straight into typed values. Fields the schema doesn't
+# declare are ignored, declared fields a record lacks (or has with an unusable type) are
+# NULL, so new mod versions never fail a load. To pick up a field added by a new version,
+# register a schema for it (usually the previous one plus that field) and add the column;
+# months staged from older versions get NULL there.
+
+
+class RecordSchema(BaseModel):
+    # first pmversion the schema applies to, e.g. "2.1.0"; "0" for the oldest records
+    since: str
+    # json_transform structure of one line
+    structure: dict
+    # base column -> SQL over the transformed line `r`
+    columns: dict[str, str]
+
+
+EVENT_V1 = {
+    "play_id": "VARCHAR",
+    "victory": "BOOLEAN",
+    "ascension_level": "INTEGER",
+    "character_chosen": "VARCHAR",
+    "currentPacks": "VARCHAR",
+    "pmversion": "VARCHAR",
+    "pickedHat": "VARCHAR",
+    "enabledExpansionPacks": "BOOLEAN",
+    "playtime": "INTEGER",
+    "floor_reached": "INTEGER",
+    "killed_by": "VARCHAR",
+    "packChoices": [{"picked": "VARCHAR", "not_picked": ["VARCHAR"]}],
+    "card_choices": [{"picked": "VARCHAR", "not_picked": ["VARCHAR"]}],
+    "master_deck": ["VARCHAR"],
+}
+
+# "Card+N" -> {card_id: 'Card', upgrade: 'N' or ''}, one regex match per card
+CARD_PARTS_SQL = "regexp_extract({card}, '^(.*?)(?:\\+(\\d+))?$', ['card_id', 'upgrade'])"
+
+COLUMNS_V1 = {
+    "play_id": "r.event.play_id",
+    "ts": "to_timestamp(r.time)",
+    "host": "r.host",
+    "victory": "coalesce(r.event.victory, FALSE)",
+    "ascension_level": "coalesce(r.event.ascension_level, 0)",
+    "character": "r.event.character_chosen",
+    "current_packs_csv": "r.event.currentPacks",
+    "pmversion": "r.event.pmversion",
+    "picked_hat": "r.event.pickedHat",
+    "expansion_enabled": "coalesce(r.event.enabledExpansionPacks, FALSE)",
+    "playtime": "coalesce(r.event.playtime, 0)",
+    "floor_reached": "coalesce(r.event.floor_reached, 0)",
+    "killed_by": "r.event.killed_by",
+    "packChoices": "r.event.packChoices",
+    "card_choices": "r.event.card_choices",
+    # parsed into (card_id, upgrade_level) here, once for every slice that reads the deck
+    "master_deck": f"""list_transform(
+        list_transform(r.event.master_deck, lambda c: {CARD_PARTS_SQL.format(card="c")}),
+        lambda p: {{'card_id': p.card_id, 'upgrade_level': coalesce(CAST(NULLIF(p.upgrade, '') AS INT), 0)}})""",
+}
+
+# oldest first
+SCHEMAS: list[RecordSchema] = [
+    RecordSchema(
+        since="0",
+        structure={"time": "DOUBLE", "host": "VARCHAR", "event": EVENT_V1},
+        columns=COLUMNS_V1,
+    ),
+]
+
+
+def _version_sql(version: str) -> str:
+    # major.minor.patch as a SQL list, compared with the PMVERSION_SQL of a line
+    parts = [int(p) for p in version.split(".")[:3]]
+    parts += [0] * (3 - len(parts))
+    return f"{parts}::BIGINT[]"
+
+
+# the leading major.minor.patch of a line's pmversion as a list of 3 BIGINTs, padded with 0s;
+# NULL if it has none or a part doesn't fit (TRY_CAST), so routing a line never raises
+PMVERSION_PARTS_SQL = ("TRY_CAST(string_split(regexp_extract(json_extract_string(text, '$.event.pmversion'), "
+                       "'^[0-9]+(\\.[0-9]+)*'), '.') AS BIGINT[])")
+PMVERSION_SQL = "CASE WHEN list_bool_and(list_transform(pv, x -> x IS NOT NULL)) THEN list_resize(pv[1:3], 3, 0) END"
+
+
+def _schema_index_sql() -> str:
+    # index into SCHEMAS of the newest schema whose `since` the line's version reaches; lines
+    # without a usable pmversion go to the oldest. One comparison per WHEN: DuckDB can't plan
+    # a range of two list comparisons (it folds them into an unsupported BETWEEN).
+    whens = "".join(f" WHEN pmv >= {_version_sql(s.since)} THEN {i}" for i, s in reversed(list(enumerate(SCHEMAS))) if i)
+    return f"CASE WHEN pmv IS NULL THEN 0{whens} ELSE 0 END"
+
+
+def stage_select(source: str) -> str:
+    """
+        SELECT of the base columns from the `text` of `source`'s rows, each
+        transformed with its version's schema. With a single registered
+        schema the pmversion isn't looked at, so every line is parsed once.
+        """
+    branches = []
+    for i, s in enumerate(SCHEMAS):
+        cols = ",\n      ".join(f"{expr} AS {name}" for name, expr in s.columns.items())
+        where = "TRUE" if len(SCHEMAS) == 1 else f"schema_idx = {i}"
+        branches.append(f"""
+    SELECT
+      {cols},
+      source_file
+    FROM (
+      SELECT json_transform(text, '{json.dumps(s.structure)}') AS r, source_file
+      FROM src
+      WHERE {where}
+    )""")
+
+    if len(SCHEMAS) > 1:
+        src = f"""
+    SELECT text, source_file, {_schema_index_sql()} AS schema_idx
+    FROM (
+      SELECT text, source_file, {PMVERSION_SQL} AS pmv
+      FROM (SELECT text, source_file, {PMVERSION_PARTS_SQL} AS pv FROM {source})
+    )"""
+    else:
+        src = f"SELECT text, source_file FROM {source}"
+    union = "\n    UNION ALL BY NAME".join(branches)
+    return f"""
+  WITH src AS ({src})
+  SELECT * FROM ({union}
+  )"""
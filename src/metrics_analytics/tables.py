@@ -1,29 +1,40 @@
-BASE_CTE = """
-WITH base AS (
+from .schema import stage_select
+
+# Run files are split into lines before any JSON is parsed (see ingest._read_lines), so a
+# malformed line is quarantined instead of failing the month. LINES_SQL checks each line of
+# the registered `raw_lines` batch; STAGE_SQL parses the good ones into `base`.
+LINES_SQL = """
+CREATE OR REPLACE TEMP TABLE lines AS
   SELECT
-    event.play_id::VARCHAR                                   AS play_id,
-    to_timestamp(time)                                       AS ts,
-    ?::INT                                                   AS year,
-    ?::INT                                                   AS month,
-    host::VARCHAR                                            AS host,
-    coalesce(event.victory::BOOLEAN, FALSE)                  AS victory,
-    coalesce(event.ascension_level::INT, 0)                  AS ascension_level,
-    event.character_chosen::VARCHAR                          AS character,
-    event.currentPacks::VARCHAR                              AS current_packs_csv,
-    event.pmversion::VARCHAR                                 AS pmversion,
-    json_extract_string(event, '$.pickedHat')::VARCHAR       AS picked_hat,
-    coalesce(event.enabledExpansionPacks::BOOLEAN, FALSE)    AS expansion_enabled,
-    coalesce(event.playtime::INT, 0)                         AS playtime,
-    coalesce(event.floor_reached::INT, 0)                    AS floor_reached,
-    json_extract_string(event, '$.killed_by')::VARCHAR       AS killed_by,
-    json_extract(event, '$.packChoices')                     AS packChoices,
-    json_extract(event, '$.card_choices')                    AS card_choices,
-    json_extract(event, '$.master_deck')                     AS master_deck
-  FROM read_json_auto(?, format='newline_delimited', filename=true) AS src
-  JOIN to_ingest AS files ON src.filename = files.path
-)
+    source_file,
+    line_no,
+    raw,
+    text,
+    CASE
+      WHEN text IS NULL                THEN 'invalid utf-8'
+      WHEN NOT json_valid(text)        THEN 'invalid json'
+      WHEN json_type(text) <> 'OBJECT' THEN 'not an object'
+    END AS error
+  FROM (SELECT *, TRY(decode(raw)) AS text FROM raw_lines)
+  -- blank lines are skipped; blank as in bytes.strip() (and tools/metric_cleaner.py), so CRLF files are fine
+  WHERE text IS NULL OR NOT regexp_matches(text, '^[ \\t\\n\\v\\f\\r]*$')
+"""
+
+QUARANTINE_SQL = """
+SELECT source_file, line_no, raw, error FROM lines WHERE error IS NOT NULL
 """
 
+# Parses the good lines of the current batch of one month's run files into the `base` staging
+# table that every slice reads from, using the registered record schemas (see schema.py).
+# Batches after the first are appended with STAGE_APPEND_SQL.
+_STAGE_SELECT = f"""
+  SELECT b.*, ?::INT AS year, ?::INT AS month
+  FROM ({stage_select("lines WHERE error IS NULL")}
+  ) b
+"""
+STAGE_SQL = "CREATE OR REPLACE TEMP TABLE base AS" + _STAGE_SELECT
+STAGE_APPEND_SQL = "INSERT INTO base BY NAME" + _STAGE_SELECT
+
 SQL_RUNS = """
 SELECT
   play_id,
@@ -40,26 +51,26 @@ SELECT
   floor_reached,
   playtime,
   killed_by,
-  COALESCE(json_array_length(master_deck), 0) AS master_deck_size
+  COALESCE(len(master_deck), 0) AS master_deck_size,
+  source_file
 FROM base"""
 
+# The nested arrays arrive in `base` as typed lists (see schema.py), so the slices unnest
+# them directly; deck cards already carry their card_id and upgrade_level.
 SQL_MASTER_DECK = """
 SELECT
   b.play_id,
   b.year,
   b.month,
-  -- raw card string from the save (may include +N)
-  json_extract_string(deck_val, '$')                    AS raw_card,
-  -- normalized id without upgrade suffix
-  REGEXP_REPLACE(json_extract_string(deck_val, '$'), '\\+\\d+$', '') AS card_id,
-  -- upgrade level parsed from suffix (+N). default 0
-  COALESCE(CAST(NULLIF(regexp_extract(json_extract_string(deck_val, '$'), '\\+(\\d+)$', 1), '') AS INT), 0) AS upgrade_level
+  d.card.card_id,
+  d.card.upgrade_level,
+  b.source_file
 FROM base b
-, LATERAL UNNEST(CAST(json_extract(b.master_deck, '$') AS JSON[])) AS d(deck_val)
+, LATERAL UNNEST(b.master_deck) AS d(card)
 """
 
 SQL_PACKS_PRESENT = """
-SELECT play_id, year, month, TRIM(pack) AS pack
+SELECT play_id, year, month, TRIM(pack) AS pack, source_file
 FROM base,
 LATERAL UNNEST(STR_SPLIT(current_packs_csv, ',')) AS t(pack)
 WHERE NULLIF(TRIM(pack), '') IS NOT NULL
@@ -71,10 +82,11 @@ SELECT
   b.play_id,
   b.year,
   b.month,
-  json_extract_string(pc_obj, '$.picked') AS picked_pack,
-  NULL::VARCHAR                           AS not_picked_pack
+  pc.choice.picked     AS picked_pack,
+  NULL::VARCHAR        AS not_picked_pack,
+  b.source_file
 FROM base b
-, LATERAL unnest(CAST(json_extract(b.packChoices, '$') AS JSON[])) AS pc(pc_obj)
+, LATERAL UNNEST(b.packChoices) AS pc(choice)
 
 UNION ALL
 
@@ -82,36 +94,148 @@ SELECT
   b.play_id,
   b.year,
   b.month,
-  NULL::VARCHAR                           AS picked_pack,
-  json_extract_string(np_val, '$')        AS not_picked_pack
+  NULL::VARCHAR        AS picked_pack,
+  np.pack              AS not_picked_pack,
+  b.source_file
 FROM base b
-, LATERAL unnest(CAST(json_extract(b.packChoices, '$') AS JSON[])) AS pc(pc_obj)
-, LATERAL unnest(CAST(json_extract(pc_obj, '$.not_picked') AS JSON[])) AS np(np_val)
+, LATERAL UNNEST(b.packChoices) AS pc(choice)
+, LATERAL UNNEST(pc.choice.not_picked) AS np(pack)
 """
 
 
 SQL_CARDS = """
 -- picked rows (exclude non-card picks)
 SELECT b.play_id, b.year, b.month, 'choice' AS context,
-       REGEXP_REPLACE(json_extract_string(cc_obj, '$.picked'), '\\+\\d+$', '') AS card_id,
-       TRUE AS picked
+       REGEXP_REPLACE(cc.choice.picked, '\\+\\d+$', '') AS card_id,
+       TRUE AS picked,
+       b.source_file
 FROM base b
-, LATERAL UNNEST(CAST(json_extract(b.card_choices, '$') AS JSON[])) AS cc(cc_obj)
-WHERE UPPER(json_extract_string(cc_obj, '$.picked')) <> 'SKIP'
-  AND json_extract_string(cc_obj, '$.picked') <> 'Singing Bowl'
+, LATERAL UNNEST(b.card_choices) AS cc(choice)
+WHERE UPPER(cc.choice.picked) <> 'SKIP'
+  AND cc.choice.picked <> 'Singing Bowl'
 UNION ALL
--- not-picked rows (extract strings, no quotes)
+-- not-picked rows
 SELECT b.play_id, b.year, b.month, 'choice',
-       REGEXP_REPLACE(json_extract_string(np_val, '$'), '\\+\\d+$', '') AS card_id,
-       FALSE AS picked
+       REGEXP_REPLACE(np.card, '\\+\\d+$', '') AS card_id,
+       FALSE AS picked,
+       b.source_file
 FROM base b
-, LATERAL UNNEST(CAST(json_extract(b.card_choices, '$') AS JSON[])) AS cc(cc_obj)
-, LATERAL UNNEST(CAST(json_extract(cc_obj, '$.not_picked') AS JSON[])) AS np(np_val)
+, LATERAL UNNEST(b.card_choices) AS cc(choice)
+, LATERAL UNNEST(cc.choice.not_picked) AS np(card)
 UNION ALL
--- final deck rows (extract strings, no quotes)
+-- final deck rows
 SELECT play_id, year, month, 'final',
-       REGEXP_REPLACE(json_extract_string(deck_val, '$'), '\\+\\d+$', '') AS card_id,
-       NULL AS picked
+       d.card.card_id,
+       NULL AS picked,
+       source_file
 FROM base
-, LATERAL UNNEST(CAST(json_extract(master_deck, '$') AS JSON[])) AS d(deck_val)
-"""
\ No newline at end of file
+, LATERAL UNNEST(master_deck) AS d(card)
+"""
+
+# slice name -> SQL over `base`; names match Config.parquet_paths
+SLICES = {
+    "runs": SQL_RUNS,
+    "master_deck": SQL_MASTER_DECK,
+    "packs_present": SQL_PACKS_PRESENT,
+    "pack_choices": SQL_PACK_CHOICES,
+    "cards": SQL_CARDS,
+}
+
+
+# Card, pack, character and pmversion names are written to the slices as integer keys into
+# dim_* tables. A key is 64 bits of the name's md5, so workers and partition rewrites can
+# encode names without sharing a key sequence.
+def dim_key(expr: str) -> str:
+    return f"(md5_number({expr}) >> 64)::UBIGINT"
+
+
+# dimension -> (table, key column, name column)
+DIMENSIONS = {
+    "card": ("dim_card", "card_key", "card_id"),
+    "pack": ("dim_pack", "pack_key", "pack"),
+    "character": ("dim_character", "character_key", "character"),
+    "pmversion": ("dim_pmversion", "pmversion_key", "pmversion"),
+}
+
+# slice -> {name column: (key column it's stored as, dimension)}
+SLICE_DIMENSIONS = {
+    "runs": {"character": ("character_key", "character"), "pmversion": ("pmversion_key", "pmversion")},
+    "master_deck": {"card_id": ("card_key", "card")},
+    "packs_present": {"pack": ("pack_key", "pack")},
+    "pack_choices": {"picked_pack": ("picked_pack_key", "pack"), "not_picked_pack": ("not_picked_pack_key", "pack")},
+    "cards": {"card_id": ("card_key", "card")},
+}
+
+
+# Rollups are rebuilt per (year, month) from that month's slice partitions, which are
+# exposed to these queries as views named after the slices. Every rollup is keyed by day
+# and pmversion so insights can be filtered by date range and mod version.
+
+# UTC date of a run; ts is a TIMESTAMPTZ, whose plain ::DATE would use the session time zone
+DAY_SQL = "(({ts}) AT TIME ZONE 'UTC')::DATE"
+
+SQL_ROLLUP_RUNS = f"""
+SELECT year, month, {DAY_SQL.format(ts="ts")} AS day, pmversion_key,
+       ascension_level, victory, expansion_enabled, master_deck_size,
+       COUNT(*) AS runs
+FROM runs
+GROUP BY ALL
+"""
+
+SQL_ROLLUP_PACKS = f"""
+SELECT r.year, r.month, {DAY_SQL.format(ts="r.ts")} AS day, r.pmversion_key,
+       p.pack_key, r.ascension_level,
+       SUM(r.victory::INT)::BIGINT AS wins,
+       COUNT(*)                    AS total
+FROM packs_present p
+JOIN runs r USING (play_id)
+GROUP BY ALL
+"""
+
+# choice rows only need the day and pmversion of their run
+RUN_ATTRS_CTE = f"""
+WITH run_attrs AS (
+  SELECT play_id, ANY_VALUE({DAY_SQL.format(ts="ts")}) AS day, ANY_VALUE(pmversion_key) AS pmversion_key
+  FROM runs
+  GROUP BY play_id
+)
+"""
+
+SQL_ROLLUP_PACK_CHOICES = RUN_ATTRS_CTE + """
+SELECT c.year, c.month, r.day, r.pmversion_key,
+       COALESCE(c.picked_pack_key, c.not_picked_pack_key) AS pack_key,
+       COUNT(c.picked_pack_key)                            AS picked,
+       COUNT(*)                                            AS offered
+FROM pack_choices c
+LEFT JOIN run_attrs r USING (play_id)
+GROUP BY ALL
+"""
+
+SQL_ROLLUP_CARD_CHOICES = RUN_ATTRS_CTE + """
+SELECT c.year, c.month, r.day, r.pmversion_key, c.card_key,
+       SUM(c.picked::INT)::BIGINT AS picked,
+       COUNT(*)                   AS seen
+FROM cards c
+LEFT JOIN run_attrs r USING (play_id)
+WHERE c.context = 'choice'
+GROUP BY ALL
+"""
+
+SQL_ROLLUP_CARD_FINALS = f"""
+SELECT f.year, f.month, {DAY_SQL.format(ts="r.ts")} AS day, r.pmversion_key, f.card_key,
+       SUM(r.victory::INT)::BIGINT AS wins,
+       COUNT(*)                    AS total
+FROM cards f
+JOIN runs r USING (play_id)
+WHERE f.context = 'final'
+GROUP BY ALL
+"""
+
+# rollup name -> (slices it reads, SQL); names match Config.rollup_paths
+ROLLUPS = {
+    "runs": (["runs"], SQL_ROLLUP_RUNS),
+    "packs": (["runs", "packs_present"], SQL_ROLLUP_PACKS),
+    "pack_choices": (["runs", "pack_choices"], SQL_ROLLUP_PACK_CHOICES),
+    "card_choices": (["runs", "cards"], SQL_ROLLUP_CARD_CHOICES),
+    "card_finals": (["runs", "cards"], SQL_ROLLUP_CARD_FINALS),
+}
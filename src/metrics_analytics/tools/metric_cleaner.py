@@ -1,105 +1,129 @@
+"""
+Drop malformed lines from the ndjson run files under a metrics root.
+
+Files are validated in parallel worker processes and only files that contain a bad
+line are rewritten; lines that parse are kept byte for byte. Files found clean are
+recorded with their size and mtime in the warehouse db's `cleaned_files` table, so
+later runs only look at new and changed files.
+
+`metrics load` doesn't need this pass: it skips malformed lines itself and keeps them
+in its quarantine table. Use it to drop them from the files for good.
+
+    python metric_cleaner.py <metrics-root> [--warehouse data/warehouse] [--workers N]
+"""
+import argparse
 import json
-import sys
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-STATE_PATH = Path(__file__).with_name(Path(__file__).stem + ".state.json")
+from metrics_analytics.archives import is_compressed
+from metrics_analytics.discovery import changed_vs_ledger, discover_files, file_sig, stat_all
+from metrics_analytics.warehouse import connect
 
-
-def load_state() -> dict:
-    try:
-        with open(STATE_PATH, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return data if isinstance(data, dict) else {}
-    except FileNotFoundError:
-        return {}
-    except Exception:
-        # Corrupt or unreadable state; start fresh.
-        return {}
-
-
-def save_state(state: dict) -> None:
-    tmp = STATE_PATH.with_suffix(".state.json.tmp")
-    with open(tmp, "w", encoding="utf-8", newline="\n") as f:
-        json.dump(state, f, ensure_ascii=False, separators=(",", ":"))
-        f.write("\n")
-    tmp.replace(STATE_PATH)
-
-
-def should_skip(path: Path, state: dict) -> bool:
-    key = str(path.resolve())
-    try:
-        cur_mtime = path.stat().st_mtime_ns
-    except FileNotFoundError:
-        return True
-    last = state.get(key)
-    return isinstance(last, int) and last == cur_mtime
+TMP_SUFFIX = ".cleaning"
+# ledger rows are written in batches, so an interrupted run keeps most of its progress
+BATCH = 1000
 
 
-def mark_cleaned(path: Path, state: dict) -> None:
+def _parse(raw: bytes) -> bytes | None:
+    """The line to keep, or None if it isn't JSON. Lines that aren't valid UTF-8 get replacement characters."""
     try:
-        state[str(path.resolve())] = path.stat().st_mtime_ns
-    except FileNotFoundError:
-        pass
+        json.loads(raw)
+        return raw
+    except UnicodeDecodeError:
+        text = raw.decode("utf-8", errors="replace")
+        try:
+            json.loads(text)
+        except ValueError:
+            return None
+        return text.encode("utf-8")
+    except ValueError:
+        return None
+
+
+def _needs_rewrite(path: Path) -> bool:
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if line and _parse(line) is not line:
+                return True
+    return False
 
 
 def clean_file(path: Path) -> tuple[int, int]:
-    """Rewrite path in place. Return (kept, skipped)."""
-    tmp_path = path.with_suffix(path.suffix + ".cleaning")
+    """Rewrite path in place without its malformed lines. Return (kept, skipped)."""
+    tmp_path = path.with_suffix(path.suffix + TMP_SUFFIX)
     kept = skipped = 0
-    with open(path, "r", encoding="utf-8", errors="replace") as fin, \
-         open(tmp_path, "w", encoding="utf-8", newline="\n") as fout:
+    with open(path, "rb") as fin, open(tmp_path, "wb") as fout:
         for line in fin:
-            if not line.strip():
+            line = line.strip()
+            if not line:
                 continue
-            try:
-                obj = json.loads(line)
-            except json.JSONDecodeError:
+            out = _parse(line)
+            if out is None:
                 skipped += 1
                 continue
-            fout.write(json.dumps(obj, separators=(",", ":"), ensure_ascii=False))
-            fout.write("\n")
+            fout.write(out)
+            fout.write(b"\n")
             kept += 1
     tmp_path.replace(path)
     return kept, skipped
 
 
-def walk_metrics(root: Path, exclude: set[Path]):
-    for p in sorted(root.rglob("*")):
-        if p.is_file() and p not in exclude and not p.name.endswith(".cleaning"):
-            yield p
-
-
-def main(root: str):
-    root = Path(root)
-    state = load_state()
-
-    # Exclude the state file if it falls under the root.
-    exclude = {STATE_PATH.resolve()}
-
-    total_kept = total_skipped = 0
-    total_skipped_due_to_state = 0
+def check_file(path: str) -> tuple[str, int, int, int, int]:
+    """
+        Worker: validate one file and rewrite it only if some line is bad.
+        Returns (path, kept, skipped, size, mtime), the signature taken after any rewrite.
+        """
+    p = Path(path)
+    kept = skipped = 0
+    if _needs_rewrite(p):
+        kept, skipped = clean_file(p)
+    size, mtime = file_sig(p)
+    return path, kept, skipped, size, mtime
 
-    for f in walk_metrics(root, exclude):
-        if should_skip(f, state):
-            total_skipped_due_to_state += 1
-            continue
 
-        kept, skipped = clean_file(f)
-        total_kept += kept
-        total_skipped += skipped
-        mark_cleaned(f, state)
-        if skipped:
-            print(f"{f}: kept {kept}, skipped {skipped}")
+def main(root: Path, warehouse: Path, workers: int):
+    # only its cleaned_files table is used, so the format of the datasets doesn't matter
+    con = connect(warehouse / "metrics.duckdb", check_format=False)
+    try:
+        # compressed files can't be rewritten in place; ingest quarantines their bad lines
+        files = [f for f in discover_files(root) if not f.name.endswith(TMP_SUFFIX) and not is_compressed(f.name)]
+        todo = [path for path, _, _ in changed_vs_ledger(con, stat_all(files), ledger="cleaned_files")]
+
+        total_kept = total_skipped = rewritten = 0
+        done: list[tuple[str, int, int]] = []
+
+        def flush():
+            if done:
+                con.executemany("INSERT OR REPLACE INTO cleaned_files VALUES (?,?,?)", done)
+                done.clear()
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, kept, skipped, size, mtime in pool.map(check_file, todo, chunksize=16):
+                if skipped or kept:
+                    rewritten += 1
+                    total_kept += kept
+                    total_skipped += skipped
+                    print(f"{path}: kept {kept}, skipped {skipped}")
+                done.append((path, size, mtime))
+                if len(done) >= BATCH:
+                    flush()
+        flush()
+    finally:
+        con.close()
 
-    save_state(state)
     print(
-        f"Done. Total kept={total_kept}, skipped_bad_lines={total_skipped}, "
-        f"skipped_already_clean={total_skipped_due_to_state}"
+        f"Done. Checked {len(todo)} file(s), rewrote {rewritten} (kept={total_kept}, "
+        f"skipped_bad_lines={total_skipped}), skipped_already_clean={len(files) - len(todo)}"
     )
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: metric_cleaner.py <metrics-root>")
-        sys.exit(1)
-    main(sys.argv[1])
+    ap = argparse.ArgumentParser(description="Drop malformed lines from ndjson run files.")
+    ap.add_argument("metrics_root", type=Path)
+    ap.add_argument("--warehouse", type=Path, default=Path("data/warehouse"), help="its db keeps the cleaned-file state")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    args = ap.parse_args()
+    main(args.metrics_root, args.warehouse, args.workers)
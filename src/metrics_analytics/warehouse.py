@@ -1,4 +1,4 @@
-import duckdb, os
+import duckdb, os, shutil, uuid
 from pathlib import Path
 
 LEDGER_SQL = """
@@ -7,12 +7,181 @@ CREATE TABLE IF NOT EXISTS ingested_files(
   size BIGINT,
   mtime BIGINT
 );
+-- month directory -> mtime_ns when its files were last ingested; lets discovery skip unchanged months
+CREATE TABLE IF NOT EXISTS ingested_dirs(
+  path TEXT PRIMARY KEY,
+  mtime BIGINT
+);
+-- run files tools/metric_cleaner.py found (or made) free of malformed lines, at that size and mtime
+CREATE TABLE IF NOT EXISTS cleaned_files(
+  path TEXT PRIMARY KEY,
+  size BIGINT,
+  mtime BIGINT
+);
+-- malformed run file lines skipped by ingest, kept for inspection and replay; replaced when the file is re-ingested
+CREATE TABLE IF NOT EXISTS quarantine(
+  source_file TEXT,
+  line_no INTEGER,
+  raw BLOB,
+  error TEXT,
+  ingested_at TIMESTAMP DEFAULT current_timestamp,
+  PRIMARY KEY (source_file, line_no)
+);
+-- FORMAT_VERSION the datasets were written with; one row
+CREATE TABLE IF NOT EXISTS warehouse_format(version INTEGER);
+-- dimensions for the keys stored in the slices, see tables.DIMENSIONS
+CREATE TABLE IF NOT EXISTS dim_card(card_key UBIGINT PRIMARY KEY, card_id TEXT);
+CREATE TABLE IF NOT EXISTS dim_pack(pack_key UBIGINT PRIMARY KEY, pack TEXT);
+CREATE TABLE IF NOT EXISTS dim_character(character_key UBIGINT PRIMARY KEY, character TEXT);
+CREATE TABLE IF NOT EXISTS dim_pmversion(pmversion_key UBIGINT PRIMARY KEY, pmversion TEXT);
 """
 
-def connect(db_path: Path) -> duckdb.DuckDBPyConnection:
+# Layout of the Parquet datasets. Bump it when a change makes the datasets of older
+# warehouses unreadable by this code (columns renamed, keyed or added without a default);
+# such warehouses have to be re-ingested with `metrics load --full`.
+#   1: name columns, no source_file lineage, no rollups (warehouses that predate the stamp)
+#   2: source_file lineage, integer dimension keys, per-month rollups keyed by UTC day
+FORMAT_VERSION = 2
+
+
+class WarehouseFormatError(RuntimeError):
+    pass
+
+
+def connect(db_path: Path, check_format: bool = True) -> duckdb.DuckDBPyConnection:
     db_path.parent.mkdir(parents=True, exist_ok=True)
     con = duckdb.connect(db_path.as_posix())
     con.execute("PRAGMA threads = " + str(os.cpu_count() or 4))
     con.execute("PRAGMA enable_object_cache")
     con.execute(LEDGER_SQL)
+    if check_format:
+        try:
+            _check_format(con, db_path)
+        except WarehouseFormatError:
+            con.close()
+            raise
     return con
+
+
+def format_version(con: duckdb.DuckDBPyConnection) -> int | None:
+    """FORMAT_VERSION the warehouse was written with, None for a warehouse nothing was ingested into yet."""
+    version = con.execute("SELECT max(version) FROM warehouse_format").fetchone()[0]
+    if version is None and con.execute("SELECT count(*) FROM ingested_files").fetchone()[0]:
+        # data written before the format was recorded
+        return 1
+    return version
+
+
+def stamp_format(con: duckdb.DuckDBPyConnection) -> None:
+    con.execute("DELETE FROM warehouse_format")
+    con.execute("INSERT INTO warehouse_format VALUES (?)", [FORMAT_VERSION])
+
+
+def _check_format(con: duckdb.DuckDBPyConnection, db_path: Path) -> None:
+    version = format_version(con)
+    if version is None:
+        stamp_format(con)
+    elif version != FORMAT_VERSION:
+        raise WarehouseFormatError(
+            f"The warehouse at {db_path.parent} has format {version}, this version of metrics reads format "
+            f"{FORMAT_VERSION}. Re-ingest it with `metrics load --full --warehouse {db_path.parent}`."
+        )
+
+
+def partition_dir(dataset: Path, year: int, month: int) -> Path:
+    return dataset / f"year={year}" / f"month={month}"
+
+
+# Partitions are versioned. A partition directory year=Y/month=M keeps its Parquet files
+# in a version subdirectory, named by the CURRENT file next to it:
+#   <dataset>/year=Y/month=M/CURRENT         "v<hex>"
+#   <dataset>/year=Y/month=M/v<hex>/*.parquet
+# A rewrite (re-ingest, rollups, compaction) writes a new version and then replaces CURRENT
+# with one rename, so readers resolve either the old or the new version and the partition
+# is never missing. Superseded versions stay on disk until sweep_partitions() deletes them.
+# It runs at the start of `metrics load` and `metrics compact`, which hold the warehouse db;
+# the query commands open that db too, so no reader can still be using them then. New rows
+# appended to a partition are moved into its current version. Partitions without CURRENT
+# (written before versions) keep their files directly in the partition directory.
+CURRENT = "CURRENT"
+
+
+def current_version(part: Path) -> Path:
+    """The directory holding the partition's current files."""
+    try:
+        return part / (part / CURRENT).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return part
+
+
+def partition_files(part: Path) -> list[Path]:
+    return sorted(current_version(part).glob("*.parquet"))
+
+
+def partition_glob(part: Path) -> str | None:
+    """Glob of the partition's current Parquet files, None if it has none."""
+    version = current_version(part)
+    return (version / "*.parquet").as_posix() if any(version.glob("*.parquet")) else None
+
+
+def dataset_globs(dataset: Path) -> list[str]:
+    """partition_glob of every partition of the dataset that has rows."""
+    return [g for part in sorted(dataset.glob("year=*/month=*")) if (g := partition_glob(part))]
+
+
+def publish_partition(new: Path | None, target: Path) -> None:
+    """
+        Make the Parquet files in directory `new` (moved, not copied) the new
+        version of partition `target`. If `new` is None or doesn't exist (the
+        rewrite produced no rows) the new version is empty.
+        """
+    target.mkdir(parents=True, exist_ok=True)
+    version = target / f"v{uuid.uuid4().hex}"
+    if new is not None and new.exists():
+        new.rename(version)
+    else:
+        version.mkdir()
+    pointer = target / f".{CURRENT}.{uuid.uuid4().hex}"
+    pointer.write_text(version.name, encoding="utf-8")
+    os.replace(pointer, target / CURRENT)
+
+
+def append_to_partition(new: Path, target: Path) -> None:
+    """Move the Parquet files in directory `new` into the current version of partition `target`."""
+    if not new.exists():
+        return
+    if not target.exists():
+        publish_partition(new, target)
+        return
+    version = current_version(target)
+    for f in new.glob("*.parquet"):
+        # names are unique (see ingest._copy_slice), so appends never replace a file
+        f.rename(version / f.name)
+
+
+def sweep_partitions(datasets: list[Path]) -> None:
+    """
+        Delete the superseded versions of every partition. Only call it while
+        holding the warehouse db, so that no reader can still be using them.
+        """
+    for dataset in datasets:
+        for part in dataset.glob("year=*/month=*"):
+            if not (part / CURRENT).exists():
+                continue
+            current = current_version(part)
+            for entry in part.iterdir():
+                if entry == current or entry.name == CURRENT:
+                    continue
+                if entry.is_dir():
+                    shutil.rmtree(entry, ignore_errors=True)
+                else:
+                    # files of the unversioned layout, or a pointer left by an interrupted publish
+                    entry.unlink(missing_ok=True)
+
+
+def ledger_version(con: duckdb.DuckDBPyConnection) -> str:
+    """Fingerprint of the `ingested_files` ledger; changes whenever an ingest adds or replaces files."""
+    n, h = con.execute(
+        "SELECT count(*), coalesce(sum(hash(path, size, mtime)::HUGEINT), 0) FROM ingested_files"
+    ).fetchone()
+    return f"{n}:{h}"
@@ -1,8 +1,13 @@
 from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 import typer
 
-from metrics_export.sheets.upload import update_summary_sheet, update_insights
+from metrics_analytics import cache as result_cache, profile
+from metrics_analytics.queries import Filters, engine
+from metrics_export.sheets.fake import DEFAULT_LATENCY, FAKE_SPREADSHEET_ID, FakeSheets
+from metrics_export.sheets.upload import set_spreadsheet_id, update_summary_sheet, update_insights
 from metrics_export.transforms import (
     win_rate_by_asc_insights,
     pack_pick_rate_insights,
@@ -15,6 +20,16 @@ from metrics_export.transforms import (
 app = typer.Typer(no_args_is_help=True)
 
 
+@app.callback()
+def main(
+        ctx: typer.Context,
+        profile_out: Path | None = typer.Option(None, "--profile", help="write per-stage timings and counters as JSON to this file ('-' for stdout)"),
+        explain: bool = typer.Option(False, help="with --profile, also capture EXPLAIN ANALYZE of every query (runs each query twice)"),
+):
+    if profile_out is not None:
+        ctx.call_on_close(profile.record_to(profile_out, ctx.invoked_subcommand or "", explain))
+
+
 def _print_insight(insight: dict):
     title, block = next(iter(insight.items()))
     headers = block["headers"]
@@ -27,16 +42,41 @@ def _print_insight(insight: dict):
         typer.echo("...")
 
 
+def _fake_sheets(enabled: bool) -> FakeSheets | None:
+    if not enabled:
+        return None
+    # keep the fake's snapshots apart from the live spreadsheet's
+    set_spreadsheet_id(FAKE_SPREADSHEET_ID)
+    return FakeSheets(latency=DEFAULT_LATENCY)
+
+
+def _print_sheets_stats(fake: FakeSheets | None):
+    if fake is None:
+        return
+    stats = fake.stats()
+    typer.echo(f"[fake-sheets] {stats['total_calls']} calls, {stats['bytes_sent']} bytes sent, "
+               f"{stats['bytes_received']} bytes received")
+    for method, count in sorted(stats["calls"].items()):
+        typer.echo(f"  {method}: {count} calls, {fake.bytes_sent[method]} bytes")
+
+
+def _filters(since: datetime | None, until: datetime | None, pmversion: str | None) -> Filters:
+    return Filters(since=since and since.date(), until=until and until.date(), pmversion=pmversion)
+
+
 @app.command()
 def summary(
         db: Path = typer.Option(Path("warehouse/metrics.duckdb")),
+        fake_sheets: bool = typer.Option(False, help="upload to an in-process fake spreadsheet and report the API calls"),
         dry_run: bool = typer.Option(False),
 ):
     """Update the summary sheet."""
     if dry_run:
         typer.echo("[dry-run] summary")
         return
-    update_summary_sheet()
+    fake = _fake_sheets(fake_sheets)
+    update_summary_sheet(sheet=fake)
+    _print_sheets_stats(fake)
 
 
 @app.command()
@@ -46,34 +86,44 @@ def insight(
         min_support: int = typer.Option(1, help="min rows threshold used by some insights"),
         mappings_dir: Path = typer.Option(Path("data"), help="dir for card→pack/rarity mappings"),
         include_overall: bool = typer.Option(True, help="only for win_by_asc"),
+        since: datetime | None = typer.Option(None, formats=["%Y-%m-%d"], help="first run date to include"),
+        until: datetime | None = typer.Option(None, formats=["%Y-%m-%d"], help="last run date to include"),
+        pmversion: str | None = typer.Option(None, help="only runs on this mod version"),
+        cache: bool = typer.Option(True, help="reuse query results cached since the last ingest"),
+        full: bool = typer.Option(False, help="drop and recreate the sheets instead of sending only the changed cells"),
+        fake_sheets: bool = typer.Option(False, help="upload to an in-process fake spreadsheet and report the API calls"),
         dry_run: bool = typer.Option(False),
 ):
     """Compute one insight and push it via update_insights()."""
     pack_to_cards, card_to_pack, card_to_rarity = load_card_mappings(mappings_dir)
+    filters = _filters(since, until, pmversion)
+    result_cache.set_enabled(cache)
 
     if kind == "win_by_asc":
-        ins = win_rate_by_asc_insights(db, min_support, include_overall)
+        ins = win_rate_by_asc_insights(db, min_support, include_overall, filters)
     elif kind == "pack_pick":
-        ins = pack_pick_rate_insights(db)
+        ins = pack_pick_rate_insights(db, filters)
     elif kind == "pack_win":
-        ins = pack_win_rate_insights(db, min_support)
+        ins = pack_win_rate_insights(db, min_support, filters)
     elif kind == "card_pick":
-        ins = card_pick_rate_insights(db, card_to_pack, card_to_rarity, min_support)
+        ins = card_pick_rate_insights(db, card_to_pack, card_to_rarity, min_support, filters)
     elif kind == "card_win":
-        ins = card_win_rate_insights(db, card_to_pack, card_to_rarity, min_support)
+        ins = card_win_rate_insights(db, card_to_pack, card_to_rarity, min_support, filters)
     elif kind == "win_by_asc_and_pack":
-        ins = pack_asc_win_rate_insights(db, min_support)
+        ins = pack_asc_win_rate_insights(db, min_support, filters)
     elif kind == "median_deck_size":
-        ins = median_deck_size_by_asc_insights(db, min_support)
+        ins = median_deck_size_by_asc_insights(db, min_support, filters)
     elif kind == "expansion_enabled":
-        ins = expansion_rate_insights(db)
+        ins = expansion_rate_insights(db, filters)
     else:
         raise typer.BadParameter("Unknown kind")
 
     if dry_run:
         _print_insight(ins)
         return
-    update_insights(ins)
+    fake = _fake_sheets(fake_sheets)
+    update_insights(ins, fake, incremental=not full)
+    _print_sheets_stats(fake)
 
 
 @app.command()
@@ -82,27 +132,50 @@ def all(
         min_support: int = typer.Option(1),
         mappings_dir: Path = typer.Option(Path("data")),
         include_overall: bool = typer.Option(True),
+        since: datetime | None = typer.Option(None, formats=["%Y-%m-%d"], help="first run date to include"),
+        until: datetime | None = typer.Option(None, formats=["%Y-%m-%d"], help="last run date to include"),
+        pmversion: str | None = typer.Option(None, help="only runs on this mod version"),
+        cache: bool = typer.Option(True, help="reuse query results cached since the last ingest"),
+        full: bool = typer.Option(False, help="drop and recreate the sheets instead of sending only the changed cells"),
+        fake_sheets: bool = typer.Option(False, help="upload to an in-process fake spreadsheet and report the API calls"),
+        workers: int = typer.Option(4, help="insights computed concurrently"),
+        summary: bool = typer.Option(True, help="also rebuild the Summary sheet from this run's insights"),
         dry_run: bool = typer.Option(False),
 ):
-    """Compute all insights and push each via update_insights()."""
+    """Compute all insights concurrently, then push them in one batched upload."""
     pack_to_cards, card_to_pack, card_to_rarity = load_card_mappings(mappings_dir)
+    filters = _filters(since, until, pmversion)
+    result_cache.set_enabled(cache)
+    engine(db)  # open the shared engine once; worker threads get their own cursors on it
 
     jobs = [
-        win_rate_by_asc_insights(db, min_support, include_overall),
-        pack_pick_rate_insights(db),
-        pack_win_rate_insights(db, min_support),
-        card_pick_rate_insights(db, card_to_pack, card_to_rarity, min_support),
-        card_win_rate_insights(db, card_to_pack, card_to_rarity, min_support),
-        pack_asc_win_rate_insights(db, min_support),
-        median_deck_size_by_asc_insights(db, min_support),
-        expansion_rate_insights(db)
+        (win_rate_by_asc_insights, db, min_support, include_overall, filters),
+        (pack_pick_rate_insights, db, filters),
+        (pack_win_rate_insights, db, min_support, filters),
+        (card_pick_rate_insights, db, card_to_pack, card_to_rarity, min_support, filters),
+        (card_win_rate_insights, db, card_to_pack, card_to_rarity, min_support, filters),
+        (pack_asc_win_rate_insights, db, min_support, filters),
+        (median_deck_size_by_asc_insights, db, min_support, filters),
+        (expansion_rate_insights, db, filters),
     ]
 
-    for ins in jobs:
-        if dry_run:
+    # Insights are computed concurrently with each other, but the upload waits for all of
+    # them: the single batched plan below (a handful of API calls for the whole export) needs
+    # every insight's shape up front, so computing and uploading no longer overlap.
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(lambda job: job[0](*job[1:]), jobs))
+
+    if dry_run:
+        for ins in results:
             _print_insight(ins)
-        else:
-            update_insights(ins)
+        return
+
+    merged = {}
+    for ins in results:
+        merged.update(ins)
+    fake = _fake_sheets(fake_sheets)
+    update_insights(merged, fake, summary=summary, incremental=not full)
+    _print_sheets_stats(fake)
 
 
 if __name__ == "__main__":
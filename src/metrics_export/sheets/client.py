@@ -0,0 +1,99 @@
+import json
+from typing import Any, Protocol
+
+from metrics_analytics import profile
+
+
+class SheetsError(RuntimeError):
+    """A Sheets API call failed (HTTP error from Google, or a limit hit in the fake)."""
+
+
+class Request(Protocol):
+    def execute(self) -> dict: ...
+
+
+class ValuesResource(Protocol):
+    def get(self, *, spreadsheetId: str, range: str, **kwargs: Any) -> Request: ...
+
+    def batchGet(self, *, spreadsheetId: str, ranges: list[str], **kwargs: Any) -> Request: ...
+
+    def update(self, *, spreadsheetId: str, range: str, valueInputOption: str, body: dict) -> Request: ...
+
+    def batchUpdate(self, *, spreadsheetId: str, body: dict) -> Request: ...
+
+
+class SheetsClient(Protocol):
+    """
+    The subset of googleapiclient's `spreadsheets()` resource the exporter uses.
+    auth() returns the real one, fake.FakeSheets an in-process stand-in.
+    """
+
+    def get(self, *, spreadsheetId: str, **kwargs: Any) -> Request: ...
+
+    def batchUpdate(self, *, spreadsheetId: str, body: dict) -> Request: ...
+
+    def values(self) -> ValuesResource: ...
+
+
+def api_errors() -> tuple[type[BaseException], ...]:
+    """Exception types a client call can raise; googleapiclient's only if it is installed."""
+    try:
+        from googleapiclient.errors import HttpError
+    except ImportError:
+        return (SheetsError,)
+    return (SheetsError, HttpError)
+
+
+class _ProfiledRequest:
+    def __init__(self, request: Request, method: str, body: Any):
+        self.request, self.method, self.body = request, method, body
+
+    def execute(self) -> dict:
+        with profile.stage(f"sheets.{self.method}", bytes_written=len(json.dumps(self.body, default=str))) as st:
+            result = self.request.execute()
+            if st is not None:
+                st.bytes_read = len(json.dumps(result, default=str))
+        return result
+
+
+class _ProfiledValues:
+    def __init__(self, values: ValuesResource):
+        self._values = values
+
+    def get(self, *, spreadsheetId: str, range: str, **kwargs: Any) -> Request:
+        return _ProfiledRequest(self._values.get(spreadsheetId=spreadsheetId, range=range, **kwargs),
+                                "values.get", {"range": range})
+
+    def batchGet(self, *, spreadsheetId: str, ranges: list[str], **kwargs: Any) -> Request:
+        return _ProfiledRequest(self._values.batchGet(spreadsheetId=spreadsheetId, ranges=ranges, **kwargs),
+                                "values.batchGet", {"ranges": ranges})
+
+    def update(self, *, spreadsheetId: str, range: str, valueInputOption: str, body: dict) -> Request:
+        return _ProfiledRequest(self._values.update(spreadsheetId=spreadsheetId, range=range,
+                                                    valueInputOption=valueInputOption, body=body),
+                                "values.update", body)
+
+    def batchUpdate(self, *, spreadsheetId: str, body: dict) -> Request:
+        return _ProfiledRequest(self._values.batchUpdate(spreadsheetId=spreadsheetId, body=body),
+                                "values.batchUpdate", body)
+
+
+class _ProfiledSheets:
+    def __init__(self, client: SheetsClient):
+        self._client = client
+
+    def get(self, *, spreadsheetId: str, **kwargs: Any) -> Request:
+        return _ProfiledRequest(self._client.get(spreadsheetId=spreadsheetId, **kwargs), "get", {})
+
+    def batchUpdate(self, *, spreadsheetId: str, body: dict) -> Request:
+        return _ProfiledRequest(self._client.batchUpdate(spreadsheetId=spreadsheetId, body=body), "batchUpdate", body)
+
+    def values(self) -> ValuesResource:
+        return _ProfiledValues(self._client.values())
+
+
+def profiled(client: SheetsClient) -> SheetsClient:
+    """`client` with every call recorded as a `sheets.<method>` profile stage; unchanged when not profiling."""
+    if profile.active() is None or isinstance(client, _ProfiledSheets):
+        return client
+    return _ProfiledSheets(client)
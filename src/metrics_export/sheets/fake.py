@@ -0,0 +1,307 @@
+import copy
+import json
+import re
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Callable
+
+from metrics_export.sheets.client import SheetsError
+
+FAKE_SPREADSHEET_ID = "fake-spreadsheet"
+# roughly what one round-trip to the live API costs
+DEFAULT_LATENCY = 0.25
+
+_CELL = re.compile(r"^([A-Z]+)(\d+)$")
+
+
+class QuotaExceeded(SheetsError):
+    """The fake's per-minute request quota was hit (HTTP 429 on the live API)."""
+
+
+def _column_index(letters: str) -> int:
+    index = 0
+    for ch in letters:
+        index = index * 26 + (ord(ch) - ord("A") + 1)
+    return index - 1
+
+
+def _parse_range(a1: str) -> tuple[str, int, int, int | None, int | None]:
+    """'Title!B3' or 'Title!A1:C9' or 'Title' -> (title, row0, col0, row1, col1), 0-based, inclusive."""
+    title, _, cells = a1.rpartition("!")
+    if not title:
+        return a1.strip("'"), 0, 0, None, None
+    title = title[1:-1].replace("''", "'") if title.startswith("'") else title
+    start, _, end = cells.partition(":")
+    m = _CELL.match(start)
+    if not m:
+        raise SheetsError(f"400 Unable to parse range: {a1}")
+    r0, c0 = int(m.group(2)) - 1, _column_index(m.group(1))
+    if not end:
+        return title, r0, c0, r0, c0
+    m = _CELL.match(end)
+    if not m:
+        raise SheetsError(f"400 Unable to parse range: {a1}")
+    return title, r0, c0, int(m.group(2)) - 1, _column_index(m.group(1))
+
+
+class _Request:
+    def __init__(self, fake: "FakeSheets", method: str, payload: Any, fn: Callable[[], dict]):
+        self.fake, self.method, self.payload, self.fn = fake, method, payload, fn
+
+    def execute(self) -> dict:
+        return self.fake._call(self.method, self.payload, self.fn)
+
+
+class _Values:
+    def __init__(self, fake: "FakeSheets"):
+        self.fake = fake
+
+    def get(self, *, spreadsheetId: str, range: str, **kwargs: Any) -> _Request:
+        return _Request(self.fake, "values.get", {"range": range},
+                        lambda: self.fake._read(spreadsheetId, range))
+
+    def batchGet(self, *, spreadsheetId: str, ranges: list[str], **kwargs: Any) -> _Request:
+        return _Request(self.fake, "values.batchGet", {"ranges": ranges},
+                        lambda: {"valueRanges": [self.fake._read(spreadsheetId, r) for r in ranges]})
+
+    def update(self, *, spreadsheetId: str, range: str, valueInputOption: str, body: dict) -> _Request:
+        return _Request(self.fake, "values.update", {"range": range, **body},
+                        lambda: self.fake._atomic(lambda: self.fake._write(spreadsheetId, range, body["values"])))
+
+    def batchUpdate(self, *, spreadsheetId: str, body: dict) -> _Request:
+        def run():
+            for vr in body.get("data", []):
+                self.fake._write(spreadsheetId, vr["range"], vr["values"])
+            return {"totalUpdatedRanges": len(body.get("data", []))}
+        return _Request(self.fake, "values.batchUpdate", body, lambda: self.fake._atomic(run))
+
+
+class FakeSheets:
+    """
+    In-process stand-in for googleapiclient's `spreadsheets()` resource
+    (client.SheetsClient), for benchmarking and checking exports offline.
+
+    It keeps sheets, grid sizes and cell values, applies batchUpdates atomically
+    and rejects what the live API rejects for the requests the exporter sends
+    (unknown sheets, duplicate titles, writes outside the grid). Every call
+    sleeps `latency` plus `latency_per_kb` per KB of request body, counts
+    against `quota_per_minute`, and is recorded in `calls` / `bytes_sent` /
+    `bytes_received`.
+    """
+
+    def __init__(self, spreadsheet_id: str = FAKE_SPREADSHEET_ID, *, latency: float = 0.0,
+                 latency_per_kb: float = 0.0, quota_per_minute: int | None = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.spreadsheet_id = spreadsheet_id
+        self.latency = latency
+        self.latency_per_kb = latency_per_kb
+        self.quota_per_minute = quota_per_minute
+        self.clock, self.sleep = clock, sleep
+
+        self.calls: Counter[str] = Counter()
+        self.bytes_sent: Counter[str] = Counter()
+        self.bytes_received: Counter[str] = Counter()
+        self.log: list[tuple[str, int]] = []
+        self._recent: deque[float] = deque()
+        self._lock = threading.Lock()
+
+        # a new spreadsheet always has one sheet
+        self.sheets: list[dict] = [self._new_sheet({"sheetId": 0, "title": "Sheet1"})]
+
+    # --- resource API ---
+    def get(self, *, spreadsheetId: str, **kwargs: Any) -> _Request:
+        def run():
+            self._check_id(spreadsheetId)
+            return {"spreadsheetId": spreadsheetId,
+                    "sheets": [{"properties": copy.deepcopy(s["properties"])} for s in self.sheets]}
+        return _Request(self, "get", {}, run)
+
+    def batchUpdate(self, *, spreadsheetId: str, body: dict) -> _Request:
+        def run():
+            self._check_id(spreadsheetId)
+            return {"spreadsheetId": spreadsheetId, "replies": [self._apply(r) for r in body.get("requests", [])]}
+        return _Request(self, "batchUpdate", body, lambda: self._atomic(run))
+
+    def values(self) -> _Values:
+        return _Values(self)
+
+    # --- inspection ---
+    def stats(self) -> dict:
+        return {
+            "calls": dict(self.calls),
+            "total_calls": sum(self.calls.values()),
+            "bytes_sent": sum(self.bytes_sent.values()),
+            "bytes_received": sum(self.bytes_received.values()),
+        }
+
+    def values_of(self, title: str) -> list[list[Any]]:
+        """The sheet's cells as a list of rows, trailing empty cells dropped."""
+        sheet = self._by_title(title)
+        if not sheet["cells"]:
+            return []
+        rows = max(r for r, _ in sheet["cells"]) + 1
+        out = []
+        for r in range(rows):
+            row = [sheet["cells"].get((r, c), "") for c in range(sheet["properties"]["gridProperties"]["columnCount"])]
+            while row and row[-1] == "":
+                row.pop()
+            out.append(row)
+        return out
+
+    # --- plumbing ---
+    def _call(self, method: str, payload: Any, fn: Callable[[], dict]) -> dict:
+        size = len(json.dumps(payload, default=str))
+        with self._lock:
+            now = self.clock()
+            while self._recent and now - self._recent[0] >= 60:
+                self._recent.popleft()
+            if self.quota_per_minute is not None and len(self._recent) >= self.quota_per_minute:
+                raise QuotaExceeded(f"429 Quota exceeded: {self.quota_per_minute} requests per minute")
+            self._recent.append(now)
+            self.calls[method] += 1
+            self.bytes_sent[method] += size
+            self.log.append((method, size))
+
+        self.sleep(self.latency + self.latency_per_kb * size / 1024)
+        with self._lock:
+            result = fn()
+            self.bytes_received[method] += len(json.dumps(result, default=str))
+        return result
+
+    def _atomic(self, fn: Callable[[], dict]) -> dict:
+        # like the live API, a failing request leaves the spreadsheet untouched
+        saved = copy.deepcopy(self.sheets)
+        try:
+            return fn()
+        except Exception:
+            self.sheets = saved
+            raise
+
+    def _check_id(self, spreadsheet_id: str) -> None:
+        if spreadsheet_id != self.spreadsheet_id:
+            raise SheetsError(f"404 Requested entity was not found: spreadsheet {spreadsheet_id}")
+
+    @staticmethod
+    def _new_sheet(props: dict) -> dict:
+        grid = {"rowCount": 1000, "columnCount": 26, **props.get("gridProperties", {})}
+        return {"properties": {**props, "gridProperties": grid}, "cells": {}}
+
+    def _reindex(self) -> None:
+        for i, s in enumerate(self.sheets):
+            s["properties"]["index"] = i
+
+    def _by_id(self, sheet_id: int) -> dict:
+        for s in self.sheets:
+            if s["properties"]["sheetId"] == sheet_id:
+                return s
+        raise SheetsError(f"400 No grid with id: {sheet_id}")
+
+    def _by_title(self, title: str) -> dict:
+        for s in self.sheets:
+            if s["properties"]["title"] == title:
+                return s
+        raise SheetsError(f"400 Unable to parse range: {title}")
+
+    def _apply(self, request: dict) -> dict:
+        (kind, body), = request.items()
+        if kind == "addSheet":
+            props = copy.deepcopy(body.get("properties", {}))
+            props.setdefault("title", f"Sheet{len(self.sheets) + 1}")
+            props.setdefault("sheetId", max((s["properties"]["sheetId"] for s in self.sheets), default=0) + 1)
+            if any(s["properties"]["title"] == props["title"] for s in self.sheets):
+                raise SheetsError(f"400 A sheet with the name \"{props['title']}\" already exists")
+            if any(s["properties"]["sheetId"] == props["sheetId"] for s in self.sheets):
+                raise SheetsError(f"400 A sheet with the id {props['sheetId']} already exists")
+            sheet = self._new_sheet(props)
+            self.sheets.insert(min(props.pop("index", len(self.sheets)), len(self.sheets)), sheet)
+            sheet["properties"].pop("index", None)
+            self._reindex()
+            return {"addSheet": {"properties": copy.deepcopy(sheet["properties"])}}
+
+        if kind == "deleteSheet":
+            sheet = self._by_id(body["sheetId"])
+            if len(self.sheets) == 1:
+                raise SheetsError("400 You can't remove all the sheets in a document")
+            self.sheets.remove(sheet)
+            self._reindex()
+            return {}
+
+        if kind == "updateSheetProperties":
+            props = body["properties"]
+            sheet = self._by_id(props["sheetId"])
+            sheet["properties"]["gridProperties"].update(props.get("gridProperties", {}))
+            grid = sheet["properties"]["gridProperties"]
+            # shrinking the grid drops the cells outside it
+            sheet["cells"] = {(r, c): v for (r, c), v in sheet["cells"].items()
+                              if r < grid["rowCount"] and c < grid["columnCount"]}
+            return {}
+
+        if kind == "updateCells":
+            rng = body["range"]
+            sheet = self._by_id(rng["sheetId"])
+            r0, c0 = rng.get("startRowIndex", 0), rng.get("startColumnIndex", 0)
+            grid = sheet["properties"]["gridProperties"]
+            r1 = rng.get("endRowIndex", grid["rowCount"])
+            c1 = rng.get("endColumnIndex", grid["columnCount"])
+            for key in [k for k in sheet["cells"] if r0 <= k[0] < r1 and c0 <= k[1] < c1]:
+                del sheet["cells"][key]
+            for i, row in enumerate(body.get("rows", [])):
+                for j, cell in enumerate(row.get("values", [])):
+                    value = next(iter(cell.get("userEnteredValue", {}).values()), "")
+                    self._set(sheet, r0 + i, c0 + j, value)
+            return {}
+
+        # formatting requests: only check that they point at an existing sheet
+        for sheet_id in _sheet_ids(body):
+            self._by_id(sheet_id)
+        return {}
+
+    def _set(self, sheet: dict, row: int, col: int, value: Any) -> None:
+        grid = sheet["properties"]["gridProperties"]
+        if row >= grid["rowCount"] or col >= grid["columnCount"]:
+            raise SheetsError(f"400 Range ({sheet['properties']['title']}!R{row + 1}C{col + 1}) exceeds grid limits. "
+                              f"Max rows: {grid['rowCount']}, max columns: {grid['columnCount']}")
+        if value == "" or value is None:
+            sheet["cells"].pop((row, col), None)
+        else:
+            sheet["cells"][(row, col)] = value
+
+    def _write(self, spreadsheet_id: str, a1: str, values: list[list[Any]]) -> dict:
+        self._check_id(spreadsheet_id)
+        title, r0, c0, _, _ = _parse_range(a1)
+        sheet = self._by_title(title)
+        for i, row in enumerate(values):
+            for j, value in enumerate(row):
+                self._set(sheet, r0 + i, c0 + j, value)
+        return {"updatedRange": a1, "updatedRows": len(values)}
+
+    def _read(self, spreadsheet_id: str, a1: str) -> dict:
+        self._check_id(spreadsheet_id)
+        title, r0, c0, r1, c1 = _parse_range(a1)
+        sheet = self._by_title(title)
+        grid = sheet["properties"]["gridProperties"]
+        r1 = grid["rowCount"] - 1 if r1 is None else r1
+        c1 = grid["columnCount"] - 1 if c1 is None else c1
+        rows = []
+        for r in range(r0, r1 + 1):
+            # like FORMATTED_VALUE reads: strings, trailing empty cells and rows omitted
+            row = [str(sheet["cells"].get((r, c), "")) for c in range(c0, c1 + 1)]
+            while row and row[-1] == "":
+                row.pop()
+            rows.append(row)
+        while rows and not rows[-1]:
+            rows.pop()
+        return {"range": a1, "values": rows} if rows else {"range": a1}
+
+
+def _sheet_ids(obj: Any):
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if k == "sheetId":
+                yield v
+            else:
+                yield from _sheet_ids(v)
+    elif isinstance(obj, list):
+        for v in obj:
+            yield from _sheet_ids(v)
@@ -0,0 +1,33 @@
+import json
+import re
+from pathlib import Path
+
+# What was last pushed to each sheet, so the next export can send only the changed cells.
+snapshot_dir = Path("data/sheets/snapshots")
+
+
+def _path(spreadsheet_id: str, title: str) -> Path:
+    return snapshot_dir / spreadsheet_id / (re.sub(r"[^\w-]+", "_", title) + ".json")
+
+
+def load_snapshot(spreadsheet_id: str, title: str) -> dict | None:
+    """{"title", "sheetId", "values"} as last pushed, or None."""
+    try:
+        with open(_path(spreadsheet_id, title), "r", encoding="utf-8") as f:
+            snap = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # Corrupt or unreadable snapshot; the sheet is simply replaced.
+        return None
+    return snap if isinstance(snap, dict) and snap.get("title") == title else None
+
+
+def save_snapshot(spreadsheet_id: str, title: str, sheet_id: int, values: list) -> None:
+    path = _path(spreadsheet_id, title)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".json.tmp")
+    with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+        json.dump({"title": title, "sheetId": sheet_id, "values": values}, f, ensure_ascii=False, separators=(",", ":"))
+        f.write("\n")
+    tmp.replace(path)
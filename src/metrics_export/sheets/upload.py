@@ -1,27 +1,35 @@
 import datetime
+import os
 from pathlib import Path
 from typing import Dict, List, Any
 
-from google.auth.exceptions import RefreshError
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-
+from metrics_export.sheets.client import SheetsClient, SheetsError, api_errors, profiled
+from metrics_export.sheets.snapshots import load_snapshot, save_snapshot
 from metrics_export.sheets.formatting import apply_summary_formatting, pack_wr_by_asc_formatting, freeze_rows_request, header_format_request, \
     auto_resize_request, basic_filter_request
 
 # Full access scope allows for reading and writing.
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-SPREADSHEET_ID = "146GPNf1aCHj5URk_oMkYS064HuRcP4vgbtCAkQ9NVWo"
+SPREADSHEET_ID = os.environ.get("METRICS_SPREADSHEET_ID", "146GPNf1aCHj5URk_oMkYS064HuRcP4vgbtCAkQ9NVWo")
 
 token_path = Path("data/sheets/token.json")
 credentials_path = Path("data/sheets/credentials.json")
 
 
+def set_spreadsheet_id(spreadsheet_id: str) -> None:
+    global SPREADSHEET_ID
+    SPREADSHEET_ID = spreadsheet_id
+
+
 # --- Auth ---
-def auth():
+def auth() -> SheetsClient:
+    # google libraries are the optional `sheets` extra; only needed for the live spreadsheet
+    from google.auth.exceptions import RefreshError
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from googleapiclient.discovery import build
+
     creds = None
     if token_path.exists():
         creds = Credentials.from_authorized_user_file(str(token_path), SCOPES)
@@ -49,17 +57,17 @@ def auth():
 
 
 # --- Low-level helpers ---
-def get_sheets_map(sheet) -> Dict[str, int]:
+def get_sheets_map(sheet: SheetsClient) -> Dict[str, int]:
     meta = sheet.get(spreadsheetId=SPREADSHEET_ID).execute()
     return {s["properties"]["title"]: s["properties"]["sheetId"] for s in meta.get("sheets", [])}
 
 
-def get_sheets_list(sheet) -> List[dict]:
+def get_sheets_list(sheet: SheetsClient) -> List[dict]:
     meta = sheet.get(spreadsheetId=SPREADSHEET_ID).execute()
     return meta.get("sheets", [])
 
 
-def ensure_sheet(sheet, title: str, rows: int, cols: int, *, index: int | None = None) -> int:
+def ensure_sheet(sheet: SheetsClient, title: str, rows: int, cols: int, *, index: int | None = None) -> int:
     """Create if missing. Return sheetId."""
     existing = get_sheets_map(sheet)
     if title in existing:
@@ -78,7 +86,7 @@ def ensure_sheet(sheet, title: str, rows: int, cols: int, *, index: int | None =
     return resp["replies"][0]["addSheet"]["properties"]["sheetId"]
 
 
-def write_values(sheet, title: str, values: List[List[Any]], start_cell: str = "A1") -> None:
+def write_values(sheet: SheetsClient, title: str, values: List[List[Any]], start_cell: str = "A1") -> None:
     sheet.values().update(
         spreadsheetId=SPREADSHEET_ID,
         range=f"{title}!{start_cell}",
@@ -87,66 +95,169 @@ def write_values(sheet, title: str, values: List[List[Any]], start_cell: str = "
     ).execute()
 
 
-def apply_requests(sheet, requests: List[dict]) -> None:
+def apply_requests(sheet: SheetsClient, requests: List[dict]) -> None:
     if requests:
         sheet.batchUpdate(spreadsheetId=SPREADSHEET_ID, body={"requests": requests}).execute()
 
 
-# --- Public API ---
-def update_insights(insights: Dict[str, dict]) -> None:
-    """
-    insights = {
-      "SheetName": {
-         "description": str,
-         "headers": [],
-         "data": [[]]
-      },
-      ...
+# --- Upload planning ---
+def _cell(value: Any) -> dict:
+    if isinstance(value, str) and value.startswith("="):
+        return {"userEnteredValue": {"formulaValue": value}}
+    return {"userEnteredValue": {"stringValue": str(value)}}
+
+
+def _column_letter(index: int) -> str:
+    letters = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(ord("A") + rem) + letters
+    return letters
+
+
+def _update_cells_request(sheet_id: int, values: List[List[Any]], cols: int = 2) -> dict:
+    # the range is open-ended downwards, so rows left over from a longer previous write are cleared too
+    return {
+        "updateCells": {
+            "range": {"sheetId": sheet_id, "startRowIndex": 0, "startColumnIndex": 0, "endColumnIndex": cols},
+            "rows": [{"values": [_cell(v) for v in row]} for row in values],
+            "fields": "userEnteredValue",
+        }
     }
-    """
-    sheet = auth()
 
-    try:
-        for title, content in insights.items():
-            headers = content["headers"]
-            rows = len(content["data"]) + 2
-            cols = len(headers) + 1  # leave extra col for the long description
 
-            # Always drop+recreate to ensure formatting is reset
-            sheet_id = replace_sheet(title, rows=rows, cols=cols)
+def read_descriptions(sheet: SheetsClient, titles: List[str]) -> Dict[str, str]:
+    """The A1 description cell of each of `titles`, read with a single values.batchGet."""
+    if not titles:
+        return {}
+    resp = sheet.values().batchGet(spreadsheetId=SPREADSHEET_ID, ranges=[f"{t}!A1" for t in titles]).execute()
+    return {t: vr.get("values", [[""]])[0][0] for t, vr in zip(titles, resp.get("valueRanges", []))}
 
-            # Build values: description, headers, data
-            values = [[content["description"]], headers, *content["data"]]
-            write_values(sheet, title, values)
 
-            # Formatting requests
-            reqs = [
-                freeze_rows_request(sheet_id, frozen=2),
-                header_format_request(sheet_id, header_row_index=1, end_col=len(headers)),
-                auto_resize_request(sheet_id, end_col=len(headers)),
-                basic_filter_request(sheet_id, headers, start_row=1, start_col=0, end_col=len(headers)),
-            ]
+def _insight_formatting(sheet_id: int, headers: List[str]) -> List[dict]:
+    reqs = [
+        freeze_rows_request(sheet_id, frozen=2),
+        header_format_request(sheet_id, header_row_index=1, end_col=len(headers)),
+        auto_resize_request(sheet_id, end_col=len(headers)),
+        basic_filter_request(sheet_id, headers, start_row=1, start_col=0, end_col=len(headers)),
+    ]
 
-            if headers and headers[0] == "Pack" and "Overall Win Rate" in headers and "A20" in headers:
-                reqs.extend(pack_wr_by_asc_formatting(headers, sheet_id))
+    if headers and headers[0] == "Pack" and "Overall Win Rate" in headers and "A20" in headers:
+        reqs.extend(pack_wr_by_asc_formatting(headers, sheet_id))
+    return reqs
 
-            apply_requests(sheet, reqs)
 
-    except HttpError as err:
-        raise RuntimeError(f"update_insights failed: {err}")
+class UploadPlan:
+    """
+    Every sheet replacement, value write and formatting request of one export,
+    sent as three calls: a batchUpdate that drops and re-adds the sheets, one
+    values.batchUpdate, and a batchUpdate with the formatting (after the values,
+    as auto-resize and filters depend on them).
 
+    New sheets get their sheetId from the plan instead of from the addSheet
+    reply, so all three bodies can be built before anything is sent.
 
-def update_summary_sheet() -> None:
-    sheet = auth()
+    With `incremental`, a sheet whose snapshot (see snapshots.py) still matches
+    the live tab is not replaced: only the changed cell blocks are written and
+    the grid is resized if the row count changed; its formatting is kept.
+    """
 
-    try:
-        sheets = get_sheets_list(sheet)
-        title_to_id = {s["properties"]["title"]: s["properties"]["sheetId"] for s in sheets}
+    def __init__(self, sheets: List[dict], *, incremental: bool = False):
+        self.existing = {s["properties"]["title"]: s["properties"] for s in sheets}
+        self._next_id = max((p["sheetId"] for p in self.existing.values()), default=0) + 1
+        self.incremental = incremental
+        self.structure: List[dict] = []
+        self.values: List[dict] = []
+        self.formatting: List[dict] = []
+        # title -> (sheetId, values) to snapshot once the plan went through
+        self.pushed: Dict[str, tuple[int, List[List[Any]]]] = {}
+
+    def _new_sheet_id(self) -> int:
+        sheet_id = self._next_id
+        self._next_id += 1
+        return sheet_id
+
+    def replace_sheet(self, title: str, rows: int, cols: int) -> int:
+        """Drop+recreate `title` (in place, if it exists) so formatting is reset. Returns the new sheetId."""
+        sheet_id = self._new_sheet_id()
+        props = {"sheetId": sheet_id, "title": title, "gridProperties": {"rowCount": rows, "columnCount": cols}}
+        old = self.existing.get(title)
+        if old is not None:
+            self.structure.append({"deleteSheet": {"sheetId": old["sheetId"]}})
+            props["index"] = old.get("index", 0)
+        self.structure.append({"addSheet": {"properties": props}})
+        self.existing[title] = props
+        return sheet_id
+
+    def add_insights(self, insights: Dict[str, dict]) -> None:
+        for title, content in insights.items():
+            headers = content["headers"]
+            # description, headers, data
+            values = [[content["description"]], headers, *content["data"]]
 
-        if "Summary" not in title_to_id:
-            summary_id = ensure_sheet(sheet, "Summary", rows=100, cols=4, index=0)
-        else:
-            summary_id = title_to_id["Summary"]
+            live = self.existing.get(title)
+            snap = load_snapshot(SPREADSHEET_ID, title) if self.incremental and live else None
+            # formatting depends on the headers, and a tab recreated by hand has a new sheetId
+            if snap and snap["sheetId"] == live["sheetId"] and snap["values"][1:2] == [headers]:
+                sheet_id = live["sheetId"]
+                self._diff_sheet(title, live, snap["values"], values)
+            else:
+                cols = len(headers) + 1  # leave extra col for the long description
+                sheet_id = self.replace_sheet(title, rows=len(values), cols=cols)
+                self.values.append({"range": f"{title}!A1", "values": values})
+                self.formatting.extend(_insight_formatting(sheet_id, headers))
+            self.pushed[title] = (sheet_id, values)
+
+    def _diff_sheet(self, title: str, live: dict, old: List[List[Any]], new: List[List[Any]]) -> None:
+        if live.get("gridProperties", {}).get("rowCount") != len(new):
+            # shrinking drops the surplus rows, growing makes room before the values are written
+            self.structure.append({"updateSheetProperties": {
+                "properties": {"sheetId": live["sheetId"], "gridProperties": {"rowCount": len(new)}},
+                "fields": "gridProperties.rowCount",
+            }})
+
+        # changed columns per row; a row that got shorter blanks its old trailing cells
+        changed: Dict[int, tuple[int, int]] = {}
+        for i, row in enumerate(new):
+            prev = old[i] if i < len(old) else []
+            width = max(len(row), len(prev))
+            cols = [j for j in range(width) if j >= len(row) or j >= len(prev) or row[j] != prev[j]]
+            if cols:
+                changed[i] = (cols[0], cols[-1])
+
+        # one rectangular block per run of consecutive changed rows
+        rows = sorted(changed)
+        start = 0
+        while start < len(rows):
+            end = start
+            while end + 1 < len(rows) and rows[end + 1] == rows[end] + 1:
+                end += 1
+            first, last = rows[start], rows[end]
+            lo = min(changed[i][0] for i in rows[start:end + 1])
+            hi = max(changed[i][1] for i in rows[start:end + 1])
+            block = [(new[i] + [""] * (hi + 1 - len(new[i])))[lo:hi + 1] for i in range(first, last + 1)]
+            self.values.append({"range": f"{title}!{_column_letter(lo)}{first + 1}", "values": block})
+            start = end + 1
+
+    def tabs(self) -> List[tuple[str, int]]:
+        """(title, sheetId) of every sheet once the plan has run, in tab order."""
+        return [(t, p["sheetId"]) for t, p in self.existing.items()]
+
+    def add_summary(self, descriptions: Dict[str, str]) -> None:
+        """
+        Rebuild the Summary sheet (created first at index 0 if missing) as part of
+        the plan: its cells and formatting join the formatting batchUpdate.
+        `descriptions` maps each tab title to the description linked next to it.
+        """
+        summary = self.existing.get("Summary")
+        if summary is None:
+            summary = {"sheetId": self._new_sheet_id(), "title": "Summary", "index": 0,
+                       "gridProperties": {"rowCount": 100, "columnCount": 4}}
+            # after the replacements, whose indices count the tabs without the new Summary
+            self.structure.append({"addSheet": {"properties": summary}})
+            self.existing["Summary"] = summary
+        summary_id = summary["sheetId"]
 
         now = datetime.datetime.now().strftime("%Y/%m/%d %H:%M")
         values: List[List[Any]] = [
@@ -154,29 +265,82 @@ def update_summary_sheet() -> None:
             [],
             ["Quick navigation"],
         ]
-
-        for t, sid in title_to_id.items():
+        for t, sid in self.tabs():
             if t == "Summary":
                 continue
-            # Safely read description cell
-            desc_resp = sheet.values().get(
-                spreadsheetId=SPREADSHEET_ID, range=f"{t}!A1"
-            ).execute()
-            description = desc_resp.get("values", [[""]])[0][0]
             link = f'=HYPERLINK("#gid={sid}", "{t}")'
-            values.append([link, description])
-
-        write_values(sheet, "Summary", values)
+            values.append([link, descriptions.get(t, "")])
 
+        self.formatting.append(_update_cells_request(summary_id, values))
         # Formatting centralized in formatting.py
-        apply_requests(sheet, apply_summary_formatting(summary_id))
+        self.formatting.extend(apply_summary_formatting(summary_id))
+
+    def execute(self, sheet: SheetsClient) -> None:
+        apply_requests(sheet, self.structure)
+        if self.values:
+            sheet.values().batchUpdate(
+                spreadsheetId=SPREADSHEET_ID,
+                body={"valueInputOption": "USER_ENTERED", "data": self.values},
+            ).execute()
+        apply_requests(sheet, self.formatting)
+
+        for title, (sheet_id, values) in self.pushed.items():
+            save_snapshot(SPREADSHEET_ID, title, sheet_id, values)
+
+
+# --- Public API ---
+def update_insights(insights: Dict[str, dict], sheet: SheetsClient | None = None, *, summary: bool = False, incremental: bool = False) -> None:
+    """
+    insights = {
+      "SheetName": {
+         "description": str,
+         "headers": [],
+         "data": [[]]
+      },
+      ...
+    }
+    Pass all insights of an export at once; they are uploaded as one UploadPlan.
+    With `summary`, the Summary sheet is rebuilt in the same plan, taking the
+    descriptions of these insights from memory. With `incremental`, sheets
+    pushed before are updated in place with only their changed cells.
+    """
+    sheet = profiled(sheet or auth())
+
+    try:
+        plan = UploadPlan(get_sheets_list(sheet), incremental=incremental)
+        plan.add_insights(insights)
+        if summary:
+            plan.add_summary(_descriptions(sheet, plan, {t: c["description"] for t, c in insights.items()}))
+        plan.execute(sheet)
+    except api_errors() as err:
+        raise SheetsError(f"update_insights failed: {err}") from err
+
+
+def _descriptions(sheet: SheetsClient, plan: UploadPlan, known: Dict[str, str]) -> Dict[str, str]:
+    # only tabs whose description isn't known from this run are read back
+    missing = [t for t, _ in plan.tabs() if t != "Summary" and t not in known]
+    return {**read_descriptions(sheet, missing), **known}
+
+
+def update_summary_sheet(descriptions: Dict[str, str] | None = None, sheet: SheetsClient | None = None) -> None:
+    """
+    Rebuild the Summary sheet with one batchUpdate. Descriptions not passed in
+    are read from the tabs' A1 cells in a single values.batchGet.
+    """
+    sheet = profiled(sheet or auth())
+
+    try:
+        plan = UploadPlan(get_sheets_list(sheet))
+        plan.add_summary(_descriptions(sheet, plan, descriptions or {}))
+        plan.execute(sheet)
 
-    except HttpError as err:
-        raise RuntimeError(f"update_summary_sheet failed: {err}")
+    except api_errors() as err:
+        raise SheetsError(f"update_summary_sheet failed: {err}") from err
 
 
-def delete_all_sheets_except_first(spreadsheet_id: str = SPREADSHEET_ID) -> int:
+def delete_all_sheets_except_first(spreadsheet_id: str | None = None) -> int:
     """Deletes all sheets except the first tab. Returns count."""
+    spreadsheet_id = spreadsheet_id or SPREADSHEET_ID
     sheet = auth()
     meta = sheet.get(spreadsheetId=spreadsheet_id).execute()
     tabs = meta.get("sheets", [])
@@ -186,11 +350,12 @@ def delete_all_sheets_except_first(spreadsheet_id: str = SPREADSHEET_ID) -> int:
     return len(delete_reqs)
 
 
-def replace_sheet(title: str, *, spreadsheet_id: str = SPREADSHEET_ID, rows: int = 100, cols: int = 26) -> int:
+def replace_sheet(title: str, *, spreadsheet_id: str | None = None, rows: int = 100, cols: int = 26) -> int:
     """
     Delete a sheet by title and re-create it in the same position.
     Returns new sheetId.
     """
+    spreadsheet_id = spreadsheet_id or SPREADSHEET_ID
     sheet = auth()
     meta = sheet.get(spreadsheetId=spreadsheet_id).execute()
     target = next((s for s in meta.get("sheets", []) if s["properties"]["title"] == title), None)
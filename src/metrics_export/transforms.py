@@ -1,9 +1,11 @@
 import json
 from pathlib import Path
 
-import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 
-from metrics_analytics.queries import win_rate_by_asc, pack_pick_rate, pack_win_rate, card_pick_rate, card_win_rate, pack_asc_win_rate, median_deck_size_by_asc, \
+from metrics_analytics import profile
+from metrics_analytics.queries import Filters, win_rate_by_asc, pack_pick_rate, pack_win_rate, card_pick_rate, card_win_rate, pack_asc_win_rate, median_deck_size_by_asc, \
     expansion_rate
 
 
@@ -41,8 +43,85 @@ def load_card_mappings(data_dir: Path | str = "data"):
     return pack_to_cards, card_to_pack, card_to_rarity
 
 
-def win_rate_by_asc_insights(db: Path, min_runs: int = 100, include_overall: bool = True) -> dict:
-    df = win_rate_by_asc(db)  # cols: Ascension Level, Won, Total, Win Rate
+# The row builders below take the queries' Arrow tables and work a column at a time with
+# pyarrow.compute; a Python loop per row cost more than the query itself for the card tables.
+# benchmarks/transforms_bench.py compares them with the former row-by-row versions.
+
+Column = pa.Array | pa.ChunkedArray
+
+
+def _pct(rates: Column, missing: str | None = None) -> list[str]:
+    """Rates as percent strings with two decimals, exactly like f"{rate * 100:.2f}"."""
+    values = pc.multiply(pc.cast(rates, pa.float64()), 100.0)
+    if missing is None:
+        return list(map("{:.2f}".format, pc.fill_null(values, float("nan")).to_pylist()))
+    return [missing if v is None or v != v else f"{v:.2f}" for v in values.to_pylist()]
+
+
+def _format_packs(packs: Column) -> pa.Array:
+    """_format_pack over a column; there are few distinct packs, so each is formatted once."""
+    if isinstance(packs, pa.ChunkedArray):
+        packs = packs.combine_chunks()
+    encoded = pc.dictionary_encode(packs)
+    formatted = pa.array([_format_pack(p) for p in encoded.dictionary.to_pylist()], pa.string())
+    return pc.take(formatted, encoded.indices)
+
+
+def _lookup(keys: Column, mapping: dict[str, str]) -> Column:
+    """mapping.get() over a column, as a hash join of the column against the mapping."""
+    idx = pc.index_in(keys, value_set=pa.array(list(mapping.keys()), keys.type))
+    return pc.take(pa.array(list(mapping.values()), pa.string()), idx)
+
+
+def _rows(*columns: Column | list) -> list[list]:
+    # zip() builds the rows without a per-row python frame; to_pylist() hands back python ints/strs
+    return list(map(list, zip(*(c if isinstance(c, list) else c.to_pylist() for c in columns))))
+
+
+def _win_by_asc_rows(table: pa.Table, min_runs: int) -> list[list]:
+    table = table.filter(pc.greater(table["Total"], min_runs))
+    return _rows(table["Ascension Level"], table["Won"], table["Total"], _pct(table["Win Rate"]))
+
+
+def _median_deck_rows(table: pa.Table, min_runs: int) -> list[list]:
+    table = table.filter(pc.greater(table["Winning Runs"], min_runs))
+    return _rows(table["Ascension Level"], table["Median Deck Size"])
+
+
+def _pack_rows(table: pa.Table) -> list[list]:
+    """Rows of a (pack, count, count, rate) result."""
+    pack, a, b, rate = table.columns
+    return _rows(_format_packs(pack), a, b, _pct(rate))
+
+
+def _card_rows(table: pa.Table, card_to_pack: dict[str, str], card_to_rarity: dict[str, str]) -> list[list]:
+    """Rows of a (card, count, count, rate) result, skipping cards without a pack mapping."""
+    packs = _lookup(table.column(0), card_to_pack)
+    keep = pc.fill_null(pc.not_equal(packs, ""), False)
+    table, packs = table.filter(keep), packs.filter(keep)
+    card, a, b, rate = table.columns
+    rarity = pc.fill_null(_lookup(card, card_to_rarity), "Unknown")
+    return _rows(rarity, _format_packs(packs), pc.replace_substring(card, "anniv5:", ""), a, b, _pct(rate))
+
+
+def _pack_asc_rows(table: pa.Table) -> list[list]:
+    rates = [_pct(table["Overall Win Rate"], missing="N/A")]
+    rates += [_pct(table[f"A{lvl}"], missing="N/A") for lvl in range(20, -1, -1)]
+    return _rows(_format_packs(table["Pack"]), *rates)
+
+
+def _build(title: str, builder, table: pa.Table, *args) -> list[list]:
+    """builder(table, *args), recorded as a `transform.<title>` profile stage."""
+    with profile.stage(f"transform.{title}", rows_in=table.num_rows) as st:
+        rows = builder(table, *args)
+        if st is not None:
+            st.rows_out = len(rows)
+    return rows
+
+
+def win_rate_by_asc_insights(db: Path, min_runs: int = 100, include_overall: bool = True,
+                             filters: Filters | None = None) -> dict:
+    table = win_rate_by_asc(db, filters=filters, as_arrow=True)  # cols: Ascension Level, Won, Total, Win Rate
 
     insights = {
         "Win Rate by Ascension Level": {
@@ -54,186 +133,104 @@ def win_rate_by_asc_insights(db: Path, min_runs: int = 100, include_overall: boo
 
     # Adds sum of all ascs entry
     if include_overall:
-        wins = int(df["Won"].sum())
-        total = int(df["Total"].sum())
+        wins = pc.sum(table["Won"]).as_py() or 0
+        total = pc.sum(table["Total"]).as_py() or 0
         win_rate = (wins / total) if total else 0.0
         insights["Win Rate by Ascension Level"]["data"].append(
             ["Overall", wins, total, f"{win_rate * 100:.2f}"]
         )
 
-    for row in df.itertuples(index=False):
-        asc, won, total, rate = row
-        if total > min_runs:
-            insights["Win Rate by Ascension Level"]["data"].append(
-                [int(asc), int(won), int(total), f"{rate * 100:.2f}"]
-            )
-
+    insights["Win Rate by Ascension Level"]["data"].extend(_build("Win Rate by Ascension Level", _win_by_asc_rows, table, min_runs))
     return insights
 
 
-def median_deck_size_by_asc_insights(db: Path, min_runs: int = 100) -> dict:
-    df = median_deck_size_by_asc(db)  # cols: Ascension Level, Median Deck Size, Total Runs
+def median_deck_size_by_asc_insights(db: Path, min_runs: int = 100, filters: Filters | None = None) -> dict:
+    table = median_deck_size_by_asc(db, filters=filters, as_arrow=True)  # cols: Ascension Level, Median Deck Size, Winning Runs
 
-    insights = {
+    return {
         "Median Deck Sizes": {
             "description": "Median deck size of winning runs for each ascension level",
             "headers": ["Ascension Level", "Median Deck Size"],
-            "data": []
+            "data": _build("Median Deck Sizes", _median_deck_rows, table, min_runs)
         }
     }
 
-    for row in df.itertuples(index=False):
-        asc, median_sz, total = row
-        if int(total) > min_runs:
-            insights["Median Deck Sizes"]["data"].append(
-                [int(asc), int(median_sz)]
-            )
-
-    return insights
 
+def pack_pick_rate_insights(db: Path, filters: Filters | None = None) -> dict:
+    table = pack_pick_rate(db, filters=filters, as_arrow=True)  # cols: Pack, Picked, Seen, Pick Rate
 
-def pack_pick_rate_insights(db: Path) -> dict:
-    df = pack_pick_rate(db)  # cols: Pack, Picked, Seen, Pick Rate
-
-    insights = {
+    return {
         "Pack Pick Rate": {
             "description": "How often a pack is picked",
             "headers": ["Pack", "Picked", "Seen", "Pick Rate"],
-            "data": []
+            "data": _build("Pack Pick Rate", _pack_rows, table)
         }
     }
 
-    for pack, picked, seen, rate in df.itertuples(index=False, name=None):
-
-        insights["Pack Pick Rate"]["data"].append(
-            [_format_pack(pack), int(picked), int(seen), f"{float(rate) * 100:.2f}"]
-        )
-
-    return insights
 
+def pack_win_rate_insights(db: Path, min_runs: int = 1, filters: Filters | None = None) -> dict:
+    table = pack_win_rate(db, min_runs, filters=filters, as_arrow=True)  # cols: Pack, Wins, Total, Win Rate
 
-def pack_win_rate_insights(db: Path, min_runs: int = 1) -> dict:
-    df = pack_win_rate(db, min_runs)  # cols: Pack, Wins, Total, Win Rate
-
-    insights = {
+    return {
         "Pack Win Rate": {
             "description": "Win rate for each pack",
             "headers": ["Pack", "Wins", "Total", "Win Rate"],
-            "data": []
+            "data": _build("Pack Win Rate", _pack_rows, table)
         }
     }
 
-    for pack, wins, total, rate in df.itertuples(index=False, name=None):
-        insights["Pack Win Rate"]["data"].append(
-            [_format_pack(pack), int(wins), int(total), f"{float(rate)*100:.2f}"]
-        )
-
-    return insights
-
 
 def card_pick_rate_insights(
     db: Path,
     card_to_pack: dict[str, str],
     card_to_rarity: dict[str, str],
-    min_seen: int = 1
+    min_seen: int = 1,
+    filters: Filters | None = None
 ) -> dict:
-    df = card_pick_rate(db, min_seen)  # cols: Card, Picked, Seen, Pick Rate
+    table = card_pick_rate(db, min_seen, filters=filters, as_arrow=True)  # cols: Card, Picked, Seen, Pick Rate
 
-    insights = {
+    return {
         "Card Pick Rate": {
             "description": "How often a card is picked when offered as a card reward",
             "headers": ["Rarity", "Pack", "Card", "Picked", "Seen", "Pick Rate"],
-            "data": []
+            "data": _build("Card Pick Rate", _card_rows, table, card_to_pack, card_to_rarity)
         }
     }
 
-    for card, picked, seen, rate in df.itertuples(index=False, name=None):
-        rarity = card_to_rarity.get(card, "Unknown")
-        pack = card_to_pack.get(card)
-
-        # skip cards without a pack mapping
-        if not pack:
-            continue
-
-        insights["Card Pick Rate"]["data"].append([
-            rarity,
-            _format_pack(pack),
-            _strip_modid_prefix(card),
-            int(picked),
-            int(seen),
-            f"{float(rate)*100:.2f}"
-        ])
-
-    return insights
-
 
 def card_win_rate_insights(
     db: Path,
     card_to_pack: dict[str, str],
     card_to_rarity: dict[str, str],
-    min_decks: int = 1
+    min_decks: int = 1,
+    filters: Filters | None = None
 ) -> dict:
-    df = card_win_rate(db, min_decks)  # cols: Card, Wins, Total, Win Rate
+    table = card_win_rate(db, min_decks, filters=filters, as_arrow=True)  # cols: Card, Wins, Total, Win Rate
 
-    insights = {
+    return {
         "Win Rate by Card": {
             "description": "Win rate for each card",
             "headers": ["Rarity", "Pack", "Card", "Wins", "Total", "Win Rate"],
-            "data": []
+            "data": _build("Win Rate by Card", _card_rows, table, card_to_pack, card_to_rarity)
         }
     }
 
-    for card, wins, total, rate in df.itertuples(index=False, name=None):
-        pack = card_to_pack.get(card)
-        rarity = card_to_rarity.get(card, "Unknown")
-
-        if not pack:
-            continue
 
-        insights["Win Rate by Card"]["data"].append([
-            rarity,
-            _format_pack(pack),
-            _strip_modid_prefix(card),
-            int(wins),
-            int(total),
-            f"{float(rate)*100:.2f}"
-        ])
-
-    return insights
-
-
-def pack_asc_win_rate_insights(db: Path, min_runs: int = 1) -> dict:
-    df = pack_asc_win_rate(db, min_runs=min_runs)
+def pack_asc_win_rate_insights(db: Path, min_runs: int = 1, filters: Filters | None = None) -> dict:
+    table = pack_asc_win_rate(db, min_runs=min_runs, filters=filters, as_arrow=True)
 
     headers = ["Pack", "Overall Win Rate"] + [f"A{lvl}" for lvl in range(20, -1, -1)]
-    insights = {
+    return {
         "Win Rate by Pack and Asc": {
             "description": "Pack win rates across ascension levels",
             "headers": headers,
-            "data": []
+            "data": _build("Win Rate by Pack and Asc", _pack_asc_rows, table)
         }
     }
 
-    for _, row in df.iterrows():
-        data_row = [
-            _format_pack(row["Pack"]),
-            (
-                f"{float(row['Overall Win Rate'])*100:.2f}"
-                if pd.notna(row.get("Overall Win Rate"))
-                else "N/A"
-            ),
-        ]
-        for lvl in range(20, -1, -1):
-            val = row.get(f"A{lvl}")
-            data_row.append(f"{float(val)*100:.2f}" if pd.notna(val) else "N/A")
-
-        insights["Win Rate by Pack and Asc"]["data"].append(data_row)
-
-    return insights
-
 
-def expansion_rate_insights(db: Path) -> dict:
-    df = expansion_rate(db)  # cols: Total Runs, With Expansion, Rate
+def expansion_rate_insights(db: Path, filters: Filters | None = None) -> dict:
+    table = expansion_rate(db, filters=filters, as_arrow=True)  # cols: Total Runs, With Expansion, Rate
 
     insights = {
         "Expansion Pack Usage": {
@@ -243,10 +240,11 @@ def expansion_rate_insights(db: Path) -> dict:
         }
     }
 
-    if not df.empty:
-        total = int(df.at[0, "Total Runs"])
-        with_exp = int(df.at[0, "With Expansion"])
-        rate_pct = (float(df.at[0, "Rate"]) * 100.0) if total else 0.0
+    if table.num_rows:
+        row = table.slice(0, 1).to_pylist()[0]
+        total = row["Total Runs"]
+        with_exp = row["With Expansion"] or 0
+        rate_pct = (row["Rate"] * 100.0) if total else 0.0
         insights["Expansion Pack Usage"]["data"].append([total, with_exp, f"{rate_pct:.2f}"])
 
     return insights
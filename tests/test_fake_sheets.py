@@ -0,0 +1,62 @@
+import pytest
+
+from metrics_export.sheets import snapshots, upload
+from metrics_export.sheets.fake import FAKE_SPREADSHEET_ID, FakeSheets
+
+
+@pytest.fixture
+def fake(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots, "snapshot_dir", tmp_path / "snapshots")
+    monkeypatch.setattr(upload, "SPREADSHEET_ID", FAKE_SPREADSHEET_ID)
+    return FakeSheets()
+
+
+def _insights(rows):
+    return {
+        "Pack Win Rate": {
+            "description": "Win rate of runs with each pack",
+            "headers": ["Pack", "Win Rate"],
+            "data": rows,
+        },
+    }
+
+
+def test_full_replace_then_incremental_diff(fake):
+    upload.update_insights(_insights([["Alpha", "0.5"], ["Beta", "0.4"]]), fake)
+
+    assert fake.values_of("Pack Win Rate") == [
+        ["Win rate of runs with each pack"],
+        ["Pack", "Win Rate"],
+        ["Alpha", "0.5"],
+        ["Beta", "0.4"],
+    ]
+    # get, then the three calls of the plan: structure, values, formatting
+    assert fake.calls == {"get": 1, "batchUpdate": 2, "values.batchUpdate": 1}
+    sheet_id = next(s["properties"]["sheetId"] for s in fake.sheets if s["properties"]["title"] == "Pack Win Rate")
+
+    fake.calls.clear()
+    fake.log.clear()
+    upload.update_insights(_insights([["Alpha", "0.5"], ["Beta", "0.45"], ["Gamma", "0.3"]]), fake, incremental=True)
+
+    assert fake.values_of("Pack Win Rate") == [
+        ["Win rate of runs with each pack"],
+        ["Pack", "Win Rate"],
+        ["Alpha", "0.5"],
+        ["Beta", "0.45"],
+        ["Gamma", "0.3"],
+    ]
+    # the tab is kept and grown by a row; no formatting batchUpdate, as the formatting stays
+    live = next(s for s in fake.sheets if s["properties"]["title"] == "Pack Win Rate")
+    assert live["properties"]["sheetId"] == sheet_id
+    assert live["properties"]["gridProperties"]["rowCount"] == 5
+    assert fake.calls == {"get": 1, "batchUpdate": 1, "values.batchUpdate": 1}
+
+
+def test_incremental_without_changes_sends_nothing_but_the_read(fake):
+    rows = [["Alpha", "0.5"]]
+    upload.update_insights(_insights(rows), fake)
+    fake.calls.clear()
+
+    upload.update_insights(_insights(rows), fake, incremental=True)
+
+    assert fake.calls == {"get": 1}